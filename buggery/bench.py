@@ -0,0 +1,252 @@
+"""Benchmarks for the buggery interpreter's hot paths.
+
+Run with:
+
+  python -m buggery.bench [--json FILE] [--compare BASELINE] [benchmarks...]
+
+Each benchmark is run several times, and the fastest time is reported. With
+--json, the results are written to FILE, and with --compare, they are compared
+to a file written earlier, and any which are more than --threshold slower are
+reported (and the exit code is 1), so regressions can be caught before a
+change is merged.
+
+  python -m buggery.bench --parse [files...]
+
+compares regenerating the parser tables with loading the shipped ones, for the
+given files or the sample files from buggery/tests/parsing.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+from optparse import OptionParser
+
+import ply.lex as lex
+import ply.yacc as yacc
+
+from buggery import Parser, VERSION, StringData, BStr
+
+
+def best_of(repeat, func):
+  """The fastest of REPEAT runs of FUNC, in seconds."""
+  times = []
+  for i in range(repeat):
+    start = time.time()
+    func()
+    times.append(time.time() - start)
+  return min(times)
+
+
+def sample_files():
+  return sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'tests', 'parsing', '*.bgr')))
+
+
+def reset_parser():
+  Parser._lexer = None
+  Parser._parser = None
+
+
+def parse_regenerating(input):
+  """Parse the way every parse used to: building the lexer and generating the
+  LALR tables from scratch."""
+  lex.lex(module=Parser())
+  parser = yacc.yacc(module=Parser(), debug=False, write_tables=False,
+                     tabmodule='buggery.no_such_parsetab', errorlog=yacc.NullLogger())
+  parser.parse(input, lexer=Parser.lexer(), tracking=True).check()
+
+
+def parse_cold(input):
+  """Parse in a fresh process: build the lexer and load the shipped tables."""
+  reset_parser()
+  Parser().parse(input)
+
+
+def parse_warm(input):
+  Parser().parse(input)
+
+
+def bench_parse(files, repeat=20):
+  print "%-30s %12s %12s %12s" % ("file", "regenerate", "cold", "warm")
+  for filename in files:
+    input = file(filename).read()
+    Parser().parse(input) # Make sure the tables exist before timing anything
+
+    results = [best_of(repeat, lambda: func(input)) for func in [parse_regenerating, parse_cold, parse_warm]]
+    print "%-30s %10.3fms %10.3fms %10.3fms" % ((os.path.basename(filename),) + tuple([r * 1000 for r in results]))
+
+
+
+##############################
+# Synthetic scripts
+##############################
+
+def synthetic_script(num_tasks):
+  """A script with NUM_TASKS tasks, using most of the language."""
+  lines = ["startup:", '  ROOT = "/tmp/bench"', ""]
+  for i in range(num_tasks):
+    lines += [
+      "@inputs(\"src/%d/*.c\")" % i,
+      "task-%d(NAME, DIR=\"build\"):" % i,
+      "  X=$ echo @NAME @DIR @ROOT",
+      "  $(X) grep -c build |> wc -l",
+      "  Y = \"@X and @NAME\"",
+      "  task-%d(\"@Y\")" % ((i + 1) % num_tasks),
+      "  { task-%d(\"a\"), task-%d(\"b\") }" % (i, i),
+      "",
+    ]
+  return "\n".join(lines)
+
+
+def commands_script(count):
+  return "run:\n" + "  $ true\n" * count
+
+
+def capture_script(size):
+  return "run:\n  X=$ head -c %d /dev/zero\n" % size
+
+
+def stdin_script(size):
+  return "run:\n  X=$ head -c %d /dev/zero\n  $(X) cat > /dev/null\n" % size
+
+
+def call_chain_script(depth):
+  """Each task calls the next, and the last one does nothing."""
+  lines = []
+  for i in range(depth):
+    lines += ["chain-%d(A):" % i, "  chain-%d(\"@A\")" % (i + 1), ""]
+  lines += ["chain-%d(A):" % depth, "  pass", ""]
+  return "\n".join(lines)
+
+
+def interpolation_script(count):
+  """A startup task with COUNT assignments, each interpolating earlier ones,
+  the way paths get built up from a few roots."""
+  lines = ["startup:", '  V0 = "base"', '  W0 = "other"']
+  for i in range(1, count):
+    lines += ['  V%d = "@V0/@W0/%d"' % (i, i), '  W%d = "@V%d.@W0.@V0"' % (i, i)]
+  return "\n".join(lines) + "\n"
+
+
+
+##############################
+# Benchmarks
+##############################
+
+# Each benchmark returns a function to time, and the number of operations it
+# does, so the result can be reported per operation.
+
+def parse_small():
+  input = synthetic_script(10)
+  return (lambda: Parser().parse(input), 1)
+
+def parse_large():
+  input = synthetic_script(1000)
+  return (lambda: Parser().parse(input), 1)
+
+def command_true():
+  bugger = Parser().parse(commands_script(50))
+  return (lambda: bugger.run("run", []), 50)
+
+def capture_stdout():
+  bugger = Parser().parse(capture_script(64 * 1024 * 1024))
+  return (lambda: bugger.run("run", []), 1)
+
+def stdin_handoff():
+  bugger = Parser().parse(stdin_script(64 * 1024 * 1024))
+  return (lambda: bugger.run("run", []), 1)
+
+def call_chain():
+  # Each level takes several Python stack frames, so this stays well within
+  # the recursion limit.
+  bugger = Parser().parse(call_chain_script(100))
+  return (lambda: bugger.run("chain-0", [StringData(BStr("x"))]), 100)
+
+def interpolation_startup():
+  bugger = Parser().parse(interpolation_script(200))
+  return (lambda: bugger.run("startup", []), 400)
+
+
+BENCHMARKS = [
+  ('parse-small', parse_small, "parse a 10-task script"),
+  ('parse-large', parse_large, "parse a 1000-task script"),
+  ('command-true', command_true, "per `$ true`"),
+  ('capture-stdout', capture_stdout, "capture 64MB of stdout"),
+  ('stdin-handoff', stdin_handoff, "capture 64MB and pass it to stdin"),
+  ('call-chain', call_chain, "per call, 100 deep"),
+  ('interpolation-startup', interpolation_startup, "per interpolated assignment"),
+]
+
+
+def run_benchmarks(names, repeat):
+  results = {}
+  for (name, setup, description) in BENCHMARKS:
+    if names and name not in names:
+      continue
+    (func, ops) = setup()
+    func() # warm up
+    seconds = best_of(repeat, func) / ops
+    results[name] = {'seconds': seconds, 'description': description}
+    print "%-24s %12.4fms  %s" % (name, seconds * 1000, description)
+  return results
+
+
+def compare(results, baseline, threshold):
+  """Print how RESULTS compare to BASELINE, and return the names of the
+  benchmarks which are more than THRESHOLD (a fraction) slower."""
+  regressions = []
+  print
+  print "%-24s %12s %12s %8s" % ("compared to baseline", "baseline", "now", "change")
+  for name in sorted(results):
+    if name not in baseline:
+      continue
+    (old, new) = (baseline[name]['seconds'], results[name]['seconds'])
+    change = (new - old) / old if old else 0.0
+    flag = ""
+    if change > threshold:
+      regressions.append(name)
+      flag = "  REGRESSION"
+    print "%-24s %10.4fms %10.4fms %+7.1f%%%s" % (name, old * 1000, new * 1000, change * 100, flag)
+  return regressions
+
+
+def main(argv):
+  parser = OptionParser(usage="%prog [options] [benchmarks...]")
+  parser.add_option("--json", dest="json", metavar="FILE",
+                    help="write the results to FILE")
+  parser.add_option("--compare", dest="compare", metavar="BASELINE",
+                    help="compare the results to BASELINE, a file written by --json")
+  parser.add_option("--threshold", dest="threshold", type="float", default=10.0, metavar="PERCENT",
+                    help="with --compare, how much slower a benchmark can get before it counts as a regression")
+  parser.add_option("--repeat", dest="repeat", type="int", default=5,
+                    help="run each benchmark REPEAT times, and take the fastest")
+  parser.add_option("--parse", dest="parse", action="store_true", default=False,
+                    help="compare ways of parsing the given files instead")
+  (options, args) = parser.parse_args(argv[1:])
+
+  if options.parse:
+    bench_parse(args or sample_files())
+    return 0
+
+  unknown = [name for name in args if name not in [b[0] for b in BENCHMARKS]]
+  if unknown:
+    parser.error("unknown benchmark: %s" % ", ".join(unknown))
+
+  results = run_benchmarks(args, options.repeat)
+
+  if options.json:
+    f = file(options.json, 'w')
+    json.dump({'version': VERSION, 'python': sys.version.split()[0], 'results': results}, f, indent=1, sort_keys=True)
+    f.close()
+
+  if options.compare:
+    baseline = json.load(file(options.compare))['results']
+    if compare(results, baseline, options.threshold / 100):
+      return 1
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
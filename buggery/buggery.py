@@ -1,19 +1,23 @@
 #!/usr/bin/env python
 
+import os
 import sys
+import signal
 import pprint
-import ply.lex as lex
-import ply.yacc as yacc
 from lcdict import lcdict
-from exceptions import UserError, CommandError
-from nose.tools import raises
+from exceptions import UserError, CommandError, TaskFailed
 import subprocess
 import shlex
-import inspect
+import hashlib
 import re
-import pdb
+import imp
+import types
+import procio
+import parallel
+import runner
 import threading
-import time
+
+VERSION = "0.1"
 
 def bgrassert (cond):
   if not cond:
@@ -32,17 +36,20 @@ class Parser(object):
     file := task*
 
     # Task declarations
-    task := ID parameter* subtask+
+    task := annotation* ID parameter* subtask+
+    annotation := ANNOTATION ('(' expr+ ')')?
     parameter := ID default-value?
     default-value := string|variable
     variable := ID
 
     # Subtask declarations
-    subtask := subtask_list | assignment
+    subtask_line := ANNOTATION? subtask
+    subtask := subtask_list | assignment | parallel
     assignment := ID? (command | call)
     subtask_list := (command|call)+
+    parallel := '{' call+ '}'
     call := ID expr*
-    command := expr string
+    command := expr string ('|>' string)*
 
     # Strings and interpolation
     string := (string-literal|variable-interpolation)+
@@ -60,10 +67,12 @@ class Parser(object):
     variable := varname:ID
 
     # Subtask declarations
-    subtask := lvalue:ID? expr
+    subtask := lvalue:ID? expr | parallel
     expr := command | call | string
+    parallel := call+
     call := taskname:ID expr*
     command := stdin:expr command:string
+    pipeline := stdin:expr stage:string+
 
     # Final
     string := (string-literal|variable-interpolation)+
@@ -77,308 +86,443 @@ class Parser(object):
   task_syntax = r'[A-Za-z][a-z-_]*'
 
 
-  def parse(self, input):
-
-    # Keep track of line numbers and such
-    def column_number(lexpos):
-      last_cr = input.rfind('\n', 0, lexpos)
-      if last_cr < 0:
-        last_cr = 0
-      column = (lexpos - last_cr)
-      return column
-
-    def add_token_cursor(t):
-      if not isinstance(t.value, str):
-        t.value.lineno = 'todo'
-        t.value.colno = 'todo'
-
-    def add_parser_cursor(p):
-      p[0].lineno = p.lineno(0)
-      p[0].colno = column_number(p.lexpos(0))
-
-
-    tokens = (
-      'STRING',
-      'ID',
-      'INDENT',
-      'COMMAND',
-    )
-
-    literals = ":,=()$"
-
-    def t_STRING(t):
-      r'"(\\.|[^\\"])*"'
-      t.value = t.value[1:-1]
-      t.value = transform_escapes(t.value)
-      t.value = StringData(BStr(t.value))
-      add_token_cursor(t)
-      return t
-
-    def transform_escapes (val):
-      val = re.sub(r'\\r', "\r", val);
-      val = re.sub(r'\\n', "\n", val);
-      val = re.sub(r'\\t', "\t", val);
-      return val
-
-    # Put this before TASKNAME
-    def t_COMMAND(t):
-      t.value = t.value.strip()
-      add_token_cursor(t)
-      return t
-    t_COMMAND.__doc__ = r'(?<=\$)\s*(\(' + Parser.var_syntax + r'\))?\s*\S[^\n]*' # Starts with '$', optional parenthesis, and goes to the end of the line.
-
-    # A task must flush left, be comprised entirely of lower-case letters and
-    # hyphens (no CamelCase allowed), and may optionally start with an
-    # upper-case letter to indicate top-level tasks. Underscores are not
-    # allowed.
-
-
-    # TODO: make tests for correct ID usage.
-    def t_ID(t):
-      add_token_cursor(t)
-      return t
-    t_ID.__doc__ = Parser.ID_syntax
-
-    def t_INDENT(t):
-      r'(?<=\n)\ \ (?=\S)' # Exactly 2 spaces, preceeded by a \n, followed by non-whitespace
-      add_token_cursor(t)
-      return t
-
-    # Low priority: Throw away the newlines that aren't indents
-    def t_NEWLINE(t):
-      r'\n'
-      t.lexer.lineno += 1
-
-    # Throw away remaining whitespace (low priority)
-    def t_WHITESPACE(t):
-      r'\s'
-
-    # Throw away comments (low priority)
-    def t_COMMENT(t):
-      r'\#[^\n]*'
-      pass
-
+  # The lexer and parser are built from the t_ and p_ methods below the first
+  # time anything is parsed, and shared by every parse after that. The LALR
+  # tables are shipped in parsetab.py, so yacc only regenerates them if the
+  # grammar changes.
+  _lexer = None
+  _parser = None
+  debug = False
+
+  def parse(self, input, verified=(), filename=None):
+    """Parse and check INPUT. VERIFIED is passed on to Buggery.check(). If the
+    script is from FILENAME, the functions of its sidecar module are tasks."""
+    buggery = self.parser().parse(input, lexer=self.lexer(), debug=self.debug, tracking=True)
+    if filename:
+      buggery.load_sidecar(filename)
+    buggery.check(verified)
+    return buggery
 
-    def t_error(t):
-      raise UserError("Lexing error (line %d): %s" % (t.lineno, str (t.__dict__)), None)
+  def parse_tasks(self, input, lineno=1):
+    """Parse INPUT, a piece of a file starting at line LINENO, and return its
+    tasks without checking them."""
+    lexer = self.lexer()
+    lexer.lineno = lineno
+    buggery = self.parser().parse(input, lexer=lexer, debug=self.debug, tracking=True)
+    return [task for task in buggery.tasks.values() if isinstance(task, BuggeryTask)]
+
+  @classmethod
+  def lexer(cls):
+    """Return a fresh lexer for one parse, sharing the compiled rules."""
+    if cls._lexer is None:
+      # PLY is only imported when something needs parsing, which a run from
+      # a cached script doesn't.
+      import ply.lex as lex
+      cls._lexer = lex.lex(module=cls(), debug=cls.debug)
+    lexer = cls._lexer.clone()
+    lexer.lineno = 1
+    return lexer
+
+  @classmethod
+  def parser(cls):
+    if cls._parser is None:
+      import ply.yacc as yacc
+      cls._parser = yacc.yacc(module=cls(), debug=cls.debug)
+    return cls._parser
+
+
+  # Keep track of line numbers and such
+  def column_number(self, lexer, lexpos):
+    last_cr = lexer.lexdata.rfind('\n', 0, lexpos)
+    if last_cr < 0:
+      last_cr = 0
+    column = (lexpos - last_cr)
+    return column
+
+  def add_token_cursor(self, t):
+    if not isinstance(t.value, str):
+      t.value.lineno = 'todo'
+      t.value.colno = 'todo'
+
+  def add_parser_cursor(self, p, index=0):
+    p[0].lineno = p.lineno(index)
+    p[0].colno = self.column_number(p.lexer, p.lexpos(index))
+
+
+  tokens = (
+    'STRING',
+    'ID',
+    'INDENT',
+    'COMMAND',
+    'ANNOTATION',
+  )
+
+  literals = ":,=()${}"
+
+  def t_STRING(self, t):
+    r'"(\\.|[^\\"])*"'
+    t.value = t.value[1:-1]
+    t.value = self.transform_escapes(t.value)
+    t.value = StringData(BStr(t.value))
+    self.add_token_cursor(t)
+    return t
+
+  def transform_escapes (self, val):
+    val = re.sub(r'\\r', "\r", val);
+    val = re.sub(r'\\n', "\n", val);
+    val = re.sub(r'\\t', "\t", val);
+    return val
+
+  # Put this before TASKNAME
+  def t_COMMAND(self, t):
+    t.value = t.value.strip()
+    self.add_token_cursor(t)
+    return t
+  t_COMMAND.__doc__ = r'(?<=\$)\s*(\(' + var_syntax + r'\))?\s*\S[^\n]*' # Starts with '$', optional parenthesis, and goes to the end of the line.
+
+  # A task must flush left, be comprised entirely of lower-case letters and
+  # hyphens (no CamelCase allowed), and may optionally start with an
+  # upper-case letter to indicate top-level tasks. Underscores are not
+  # allowed.
+
+
+  # Annotations go on the lines before a task, eg "@inputs("*.c")"
+  def t_ANNOTATION(self, t):
+    r'@[a-z][a-z0-9-_]*'
+    t.value = t.value[1:]
+    self.add_token_cursor(t)
+    return t
+
+  # TODO: make tests for correct ID usage.
+  def t_ID(self, t):
+    self.add_token_cursor(t)
+    return t
+  t_ID.__doc__ = ID_syntax
+
+  def t_INDENT(self, t):
+    r'(?<=\n)\ \ (?=\S)' # Exactly 2 spaces, preceeded by a \n, followed by non-whitespace
+    self.add_token_cursor(t)
+    return t
+
+  # Low priority: Throw away the newlines that aren't indents
+  def t_NEWLINE(self, t):
+    r'\n'
+    t.lexer.lineno += 1
+
+  # Throw away remaining whitespace (low priority)
+  def t_WHITESPACE(self, t):
+    r'\s'
+
+  # Throw away comments (low priority)
+  def t_COMMENT(self, t):
+    r'\#[^\n]*'
+    pass
 
-    def p_error(p):
-      raise UserError("Parsing error (line %d): %s" % (p.lineno, str (p.__dict__)), None)
 
+  def t_error(self, t):
+    raise UserError("Lexing error (line %d): %s" % (t.lineno, str (t.__dict__)), None)
 
-    def p_file(p):
-      """
-        file : task_list
-      """
-      p[0] = Buggery(p[1])
-      add_parser_cursor(p)
+  def p_error(self, p):
+    if p is None:
+      raise UserError("Parsing error: unexpected end of file", None)
+    raise UserError("Parsing error (line %d): %s" % (p.lineno, str (p.__dict__)), None)
 
 
-    def p_task_list(p):
-      """
-        task_list : task_list task
-                  | empty
-      """
-      if len(p) == 2:
-        p[0] = []
-      else:
-        p[0] = p[1] + [p[2]]
+  def p_file(self, p):
+    """
+      file : task_list
+    """
+    p[0] = Buggery(p[1])
+    self.add_parser_cursor(p)
+    p[0].source_digests = self.source_digests(p.lexer.lexdata, p[1])
 
+  def source_digests(self, input, tasks):
+    """Hash the text of each task, which runs up to the start of the next one."""
+    starts = sorted([t.lexpos for t in tasks]) + [len(input)]
+    ends = dict(zip(starts, starts[1:]))
+    return dict([(t.name.lower(), hashlib.sha1(input[t.lexpos:ends[t.lexpos]]).hexdigest()) for t in tasks])
 
-    def p_empty(p):
-      """
-        empty :
-      """
-      pass
 
+  def p_task_list(self, p):
+    """
+      task_list : task_list task
+                | empty
+    """
+    if len(p) == 2:
+      p[0] = []
+    else:
+      p[0] = p[1] + [p[2]]
 
-    def p_task(p):
-      """
-        task : ID ':' subtask_lines
-             | ID '(' param_list ')' ':' subtask_lines
-      """
-      name = p[1]
-      if len(p) == 4:
-        params = []
-        subtasks = p[3]
-      else:
-        params = p[3]
-        subtasks = p[6]
 
-      p[0] = BuggeryTask (name, params, subtasks)
-      add_parser_cursor(p)
-      if self.debug:
-        print ("Completed a task:\n" + pprint.pformat(p[0]))
+  def p_empty(self, p):
+    """
+      empty :
+    """
+    pass
 
 
-    def p_subtask_lines(p):
-      """
-        subtask_lines : subtask_lines subtask_line
+  def p_task(self, p):
+    """
+      task : annotation_list ID ':' subtask_lines
+           | annotation_list ID '(' param_list ')' ':' subtask_lines
+    """
+    annotations = p[1]
+    name = p[2]
+    if len(p) == 5:
+      params = []
+      subtasks = p[4]
+    else:
+      params = p[4]
+      subtasks = p[7]
+
+    p[0] = BuggeryTask (name, params, subtasks, annotations)
+    self.add_parser_cursor(p, 2)
+    # Where the task's text starts, including its annotations
+    p[0].lexpos = p.lexspan(1)[0] if annotations else p.lexpos(2)
+    if self.debug:
+      print ("Completed a task:\n" + pprint.pformat(p[0]))
+
+
+  def p_annotation_list(self, p):
+    """
+      annotation_list : annotation_list annotation
                       | empty
-      """
-      if len(p) == 2:
-        p[0] = []
-      elif isinstance(p[2], list): # subtask_line can be a subtask_list
-        p[0] = p[1] + p[2]
-      else:
-        p[0] = p[1] + [p[2]]
-
-
-    def p_subtask_line(p):
-      # RHS can be any expression if lvalue provided.
-      # One of more calls (call-list)
-      """
-        subtask_line : INDENT lvalue expr
-                     | INDENT call_list
-                     | INDENT command
-      """
-      if len(p) == 3:
-        p[0] = p[2] # same for command or call_list
-
-      else:
-        p[0] = Assignment (p[2], p[3])
-        add_parser_cursor(p)
-
-    def p_expr(p):
-      """
-        expr : command
-             | call
-             | STRING
-      """
-      p[0] = p[1]
-      add_parser_cursor(p)
-
-
-    def p_command(p):
-      """
-      command : '$' COMMAND
-      """
-      # COMMAND may start with a variable in parens, which is hard to split out with the lexer. So do it here.
-      command = p[2]
-      stdin = None
-      if command[0] == '(':
-        m = re.match(r'\(\s*(' + Parser.var_syntax + ')\s*\)?(.*)', command)
-
-        stdin = m.group(1).strip()
-        command = m.group(2).strip()
-
+    """
+    if len(p) == 2:
+      p[0] = []
+    else:
+      p[0] = p[1] + [p[2]]
+
+
+  def p_annotation(self, p):
+    """
+      annotation : ANNOTATION
+                 | ANNOTATION '(' arg_list ')'
+    """
+    args = []
+    if len(p) > 2:
+      args = p[3]
+
+    p[0] = Annotation(p[1], args)
+    self.add_parser_cursor(p)
+
+
+  def p_subtask_lines(self, p):
+    """
+      subtask_lines : subtask_lines subtask_line
+                    | empty
+    """
+    if len(p) == 2:
+      p[0] = []
+    elif isinstance(p[2], list): # subtask_line can be a subtask_list
+      p[0] = p[1] + p[2]
+    else:
+      p[0] = p[1] + [p[2]]
+
+
+  def p_subtask_line(self, p):
+    # A line may have an annotation, eg "@barrier $ make install"
+    """
+      subtask_line : INDENT subtask
+                   | INDENT ANNOTATION subtask
+    """
+    p[0] = p[len(p) - 1]
+    # Assignments and parallel groups start where their line does
+    if isinstance(p[0], (Assignment, Parallel)):
+      self.add_parser_cursor(p)
+
+    if len(p) == 4:
+      if p[2] != 'barrier':
+        raise UserError("Unknown line annotation: @%s" % p[2], p[0] if isinstance(p[0], Node) else p[0][0])
+      for subtask in (p[0] if isinstance(p[0], list) else [p[0]]):
+        subtask.barrier = True
+
+  def p_subtask(self, p):
+    # RHS can be any expression if lvalue provided.
+    # One of more calls (call-list)
+    """
+      subtask : lvalue expr
+              | call_list
+              | command
+              | '{' call_list '}'
+    """
+    if len(p) == 2:
+      p[0] = p[1] # same for command or call_list
+      # Nothing can use the output of a pipeline on its own line
+      if isinstance(p[0], Pipeline):
+        p[0].discard_output = True
+
+    elif p[1] == '{':
+      p[0] = Parallel (p[2])
+
+    else:
+      p[0] = Assignment (p[1], p[2])
+
+  def p_expr(self, p):
+    """
+      expr : command
+           | call
+           | STRING
+    """
+    p[0] = p[1]
+    self.add_parser_cursor(p)
+
+
+  def p_command(self, p):
+    """
+    command : '$' COMMAND
+    """
+    # COMMAND may start with a variable in parens, which is hard to split out with the lexer. So do it here.
+    command = p[2]
+    stdin = None
+    if command[0] == '(':
+      m = re.match(r'\(\s*(' + Parser.var_syntax + ')\s*\)?(.*)', command)
+
+      stdin = m.group(1).strip()
+      command = m.group(2).strip()
+
+    stages = self.split_pipeline(command)
+    if len(stages) > 1:
+      p[0] = Pipeline([BStr(stage) for stage in stages], stdin)
+    else:
       p[0] = Command(BStr(command), stdin)
-      add_parser_cursor(p)
-
-
-    def p_lvalue(p):
-      """
-        lvalue : ID '='
-      """
-      p[0] = p[1]
-
-
-    def p_call_list(p):
-      """
-        call_list : call ',' call_list
-                  | call
-      """
-      if len(p) == 2:
-        p[0] = [p[1]]
-      else:
-        p[0] = [p[1]] + p[3]
-
-
-    def p_call(p):
-      """
-        call : ID '(' arg_list ')'
-             | ID
-      """
-      name = p[1]
-      args = []
-      if len(p) > 2:
-        args = p[3]
-
-      p[0] = Call(name, args)
-      add_parser_cursor(p)
-
-
-    def p_arg_list(p):
-      """
-        arg_list : arg ',' arg_list
-                 | arg
-      """
-      if len(p) == 2:
-        p[0] = [p[1]]
-      else:
-        p[0] = [p[1]] + p[3]
-
-
-    def p_arg(p):
-      """
-        arg : variable
-            | STRING
-      """
-      p[0] = p[1]
-
-
-    def p_param_list(p):
-      """
-        param_list : param ',' param_list
-                   | param
-      """
-      if len(p) == 2:
-        p[0] = [p[1]]
-      else:
-        p[0] = [p[1]] + p[3]
-
-
-    def p_param(p):
-      """
-        param : ID
-              | ID '=' default_param
-      """
-      name = p[1]
-      default = None
-      if len(p) == 4:
-        default = p[3]
-
-      p[0] = Param(name, default)
-      add_parser_cursor(p)
-
-
-    def p_default_param(p):
-      """
-        default_param : arg
-      """
-      p[0] = p[1]
-
-
-    def p_variable(p):
-      """
-        variable : ID
-      """
-      p[0] = Variable(p[1])
-      add_parser_cursor(p)
-
-
-
-
-
-    debug = False
-    self.debug = debug
-    lex.lex(debug=debug)
-    parser = yacc.yacc(debug=debug)
-    buggery = parser.parse(input, debug=debug, tracking=True)
-    buggery.check()
-    return buggery
+    self.add_parser_cursor(p)
+
+  @staticmethod
+  def split_pipeline(command):
+    """Split COMMAND at each '|>' which isn't quoted."""
+    stages = []
+    start = 0
+    quote = None
+    i = 0
+    while i < len(command):
+      c = command[i]
+      if c == '\\' and quote != "'":
+        i += 1 # skip the escaped character
+      elif quote:
+        if c == quote:
+          quote = None
+      elif c in "'\"":
+        quote = c
+      elif command.startswith('|>', i):
+        stages.append(command[start:i].strip())
+        start = i + 2
+        i += 1
+      i += 1
+
+    stages.append(command[start:].strip())
+    return stages
+
+
+  def p_lvalue(self, p):
+    """
+      lvalue : ID '='
+    """
+    p[0] = p[1]
+
+
+  def p_call_list(self, p):
+    """
+      call_list : call ',' call_list
+                | call
+    """
+    if len(p) == 2:
+      p[0] = [p[1]]
+    else:
+      p[0] = [p[1]] + p[3]
+
+
+  def p_call(self, p):
+    """
+      call : ID '(' arg_list ')'
+           | ID
+    """
+    name = p[1]
+    args = []
+    if len(p) > 2:
+      args = p[3]
+
+    p[0] = Call(name, args)
+    self.add_parser_cursor(p)
+
+
+  def p_arg_list(self, p):
+    """
+      arg_list : arg ',' arg_list
+               | arg
+    """
+    if len(p) == 2:
+      p[0] = [p[1]]
+    else:
+      p[0] = [p[1]] + p[3]
+
+
+  def p_arg(self, p):
+    """
+      arg : variable
+          | STRING
+    """
+    p[0] = p[1]
+
+
+  def p_param_list(self, p):
+    """
+      param_list : param ',' param_list
+                 | param
+    """
+    if len(p) == 2:
+      p[0] = [p[1]]
+    else:
+      p[0] = [p[1]] + p[3]
+
+
+  def p_param(self, p):
+    """
+      param : ID
+            | ID '=' default_param
+    """
+    name = p[1]
+    default = None
+    if len(p) == 4:
+      default = p[3]
+
+    p[0] = Param(name, default)
+    self.add_parser_cursor(p)
+
+
+  def p_default_param(self, p):
+    """
+      default_param : arg
+    """
+    p[0] = p[1]
+
+
+  def p_variable(self, p):
+    """
+      variable : ID
+    """
+    p[0] = Variable(p[1])
+    self.add_parser_cursor(p)
 
 
 # Abstract classes
 class Node(object):
+  """Nodes keep their attributes in __slots__, since big scripts have a lot of
+  them. Each class lists its FIELDS, which make up its definition (used by
+  __repr__ and describe()), and which of those are CHILDREN, holding nodes or
+  lists of nodes (used by traverse()). Every node knows where it came from in
+  the file, in lineno and colno."""
+  __slots__ = ('lineno', 'colno')
+  fields = ()
+  children = ()
 
   def traverse(self, callback_name, state):
     method = getattr(self, callback_name, None)
     if method != None:
       method(state)
 
-    for k,v in self.__dict__.iteritems():
-      self._nested_traverse(v, callback_name, state)
+    for field in self.children:
+      self._nested_traverse(getattr(self, field, None), callback_name, state)
 
   def _nested_traverse(self, item, callback_name, state):
     """Check subelements for Nodes to be traversed"""
@@ -395,31 +539,115 @@ class Node(object):
 
   def __repr__(self):
     name = self.__class__.__name__.lower()
-    attrs = str(self.__dict__)
+    attrs = str(dict([(field, getattr(self, field, None)) for field in self.fields]))
     return '%s: %s' % (name, attrs)
 
 class Subtask(Node):
-  pass
+  # `barrier` is only set on subtasks marked @barrier, so read it with getattr
+  __slots__ = ('barrier',)
+  # With -k, whether subtasks after this one may still run if it fails
+  keeps_going = False
+
+  def calls(self):
+    """The calls this subtask makes directly."""
+    return []
 
 
 # Concrete classes
 class Task(Node):
+  # KEY is the name as tasks are looked up, in lower case
+  __slots__ = ('name', 'key', '_summary')
+  fields = ('name',)
+
+  # Builtins don't have any variables
+  layout = {}
+
   def __init__(self, name):
     self.name = name
+    self.key = intern(name.lower())
+
+  def is_pure(self):
+    return False
+
+  def callees(self):
+    return []
+
+  def summary(self):
+    """What callers and the checker need to know about this task, worked out
+    once."""
+    if getattr(self, '_summary', None) is None:
+      self._summary = self.summarize()
+    return self._summary
+
+  def param_count(self):
+    return self.summary().param_count
+
+  def required_param_count(self):
+    return self.summary().required_param_count
+
+
+class TaskSummary(object):
+  """The variables a task defines, whether it returns a value, and how many
+  parameters it takes."""
+
+  def __init__(self, defs, returns_value, param_count, required_param_count):
+    self.defs = defs
+    self.returns_value = returns_value
+    self.param_count = param_count
+    self.required_param_count = required_param_count
+
+  def key(self):
+    return (self.returns_value, self.param_count, self.required_param_count)
 
 
 class BuggeryTask(Task):
+  __slots__ = ('params', 'subtasks', 'annotations', 'layout', 'retval_slot', 'lexpos')
+  fields = ('name', 'params', 'subtasks', 'annotations')
+  children = ('params', 'subtasks', 'annotations')
 
-  def __init__(self, name, params, subtasks):
+  def __init__(self, name, params, subtasks, annotations=[]):
     super(BuggeryTask, self).__init__(name)
     self.params = params
     self.subtasks = subtasks
+    self.annotations = annotations
 
-  def param_count(self):
-    return len(self.params)
+  def annotation(self, name):
+    for a in self.annotations:
+      if a.name == name:
+        return a
+    return None
 
-  def required_param_count(self):
-    return len([p for p in self.params if not p.default])
+  def annotation_values(self, buggery, name):
+    """Evaluate the arguments of the annotation NAME in the current frame."""
+    annotation = self.annotation(name)
+    if annotation is None:
+      return []
+    return [arg.eval(buggery).as_string() for arg in annotation.args]
+
+  def is_pure(self):
+    return self.annotation('pure') is not None
+
+  def is_incremental(self):
+    return self.annotation('inputs') is not None or self.annotation('outputs') is not None
+
+  def is_dataflow(self):
+    return self.annotation('dataflow') is not None
+
+  def uses(self):
+    """The variables the task's annotations and subtasks read."""
+    result = set()
+    for node in self.annotations + self.subtasks:
+      result.update(node.uses())
+    return result
+
+  def callees(self):
+    """The names of the tasks this task calls."""
+    result = []
+    for st in self.subtasks:
+      for call in st.calls():
+        if call.target not in result:
+          result.append(call.target)
+    return result
 
   def run(self, buggery, actuals, caller):
 
@@ -441,97 +669,193 @@ class BuggeryTask(Task):
       if actual == None:
         raise UserError("Null is not a valid value")
 
-      buggery.set_var(p.name, actual)
+      buggery.store(p.slot, actual)
+
+    if buggery.stamps and self.is_incremental():
+      return buggery.stamps.run(buggery, self, lambda: self.run_subtasks(buggery))
+
+    if self.name == 'startup' and buggery.options.lazy_startup:
+      return self.run_lazily(buggery)
+
+    return self.run_subtasks(buggery)
+
+  def run_subtasks(self, buggery):
+    if buggery.options.keep_going:
+      self.keep_going(buggery)
+    elif self.is_dataflow():
+      parallel.run_graph(buggery, [st.eval for st in self.subtasks], self.dependencies())
+    else:
+      for subtask in self.subtasks:
+        subtask.eval(buggery)
+
+    # There may not be a RETVAL. Ignore it so.
+    if self.retval_slot is not None:
+      return buggery.peek(self.retval_slot)
+
+  def dependencies(self):
+    """For @dataflow, the indices of the subtasks which each subtask has to wait
+    for: those which define a variable it uses (RAW), use a variable it
+    defines (WAR), or define the same variable (WAW). Subtasks marked
+    @barrier wait for everything before them, and everything after waits for
+    them."""
+    uses = [set(st.uses()) for st in self.subtasks]
+    defs = [set(st.defs()) for st in self.subtasks]
+    barriers = [getattr(st, 'barrier', False) for st in self.subtasks]
+
+    result = []
+    for j in range(len(self.subtasks)):
+      result.append([i for i in range(j)
+                     if barriers[i] or barriers[j]
+                     or uses[j] & defs[i] or defs[j] & uses[i] or defs[j] & defs[i]])
+    return result
 
-    # Run subtasks
+  def keep_going(self, buggery):
+    """Run the subtasks for -k. A failed call only fails this task, and the
+    calls after it still run, unless they read a variable which the failed
+    line (such as `X = compute`) left unassigned; the next command or
+    assignment might depend on it, so it ends the task. Failed commands are
+    recorded in the Buggery object."""
+    failed = False
+    unassigned = set()
     for subtask in self.subtasks:
-      subtask.eval(buggery)
+      if failed and not subtask.keeps_going:
+        break
+      if unassigned & set(subtask.uses()):
+        unassigned.update(subtask.defs())
+        continue
+      try:
+        subtask.eval(buggery)
+      except TaskFailed:
+        failed = True
+        unassigned.update(subtask.defs())
+      except CommandError, e:
+        buggery.record_failure(self, subtask, e.proc)
+        raise TaskFailed(self.name)
+
+    if failed:
+      raise TaskFailed(self.name)
+
+  def run_lazily(self, buggery):
+    """Run startup for --lazy-startup. Each assignment to a global is left in
+    its slot as a Thunk, and runs when the global is first read, after any
+    globals it reads. A global assigned more than once has to be assigned in
+    order, though, as does one which reads such a global, or RETVAL. Other
+    subtasks, such as commands and calls, run as usual."""
+    counts = {}
+    for st in self.subtasks:
+      for name in st.defs():
+        counts[name] = counts.get(name, 0) + 1
 
-    # There may not be a key. Ignore it so.
-    try:
-      return buggery.get_var("RETVAL")
-    except:
-      pass
+    for st in self.subtasks:
+      if isinstance(st, Assignment) and st.lvalue != "RETVAL" and counts[st.lvalue] == 1 \
+          and all([counts.get(name, 0) <= 1 for name in st.uses()]):
+        buggery.globals[st.slot[1]] = Thunk(st)
+      else:
+        st.eval(buggery)
+
+    if self.retval_slot is not None:
+      return buggery.peek(self.retval_slot)
 
   # The startup task has defs which become global variables, so we need to define this
   def defs(self):
-    l = []
-    x = [st.defs() for st in self.subtasks]
-    map(l.extend, x)
-    return l
+    return self.summary().defs
 
   def returns_value (self):
-    return "RETVAL" in self.defs()
-
-
-
-  def _check(self, buggery):
-    if len(self.subtasks) == 0:
-      raise UserError ("Task %s has no subtasks" % self.name, self)
+    return self.summary().returns_value
 
-    self.check_initialized_variables(buggery)
-    self.check_return_values(buggery)
-
-  def check_return_values(self, buggery):
+  def summarize(self):
+    defs = []
     for st in self.subtasks:
-      if isinstance(st, Assignment):
-        if isinstance (st.rvalue, Call):
-          name = st.rvalue.target
-          if not buggery.get_task (name).returns_value():
-            raise UserError ("Task %s does not return a value" % name, st.rvalue)
-
-
+      defs.extend(st.defs())
+    return TaskSummary(defs, "RETVAL" in defs, len(self.params), len([p for p in self.params if not p.default]))
 
 
-  def check_initialized_variables(self, buggery):
 
-    # We can statically check all uninitialized variables, since the control flow is linear.
-    inited_vars = set()
-
-    # Add the parameters
-    inited_vars = inited_vars.union([p.name for p in self.params])
+  def resolve_variables(self, buggery):
+    """Assign a slot in the stack frame to each parameter and local variable,
+    and point every use of a variable at its slot. Startup's variables are
+    the globals, which live in their own frame."""
+    if self.name == 'startup':
+      resolver = Resolver(buggery.global_layout, buggery.global_layout, True)
+    else:
+      layout = {}
+      for name in [p.name for p in self.params] + self.summary().defs:
+        layout.setdefault(name, len(layout))
+      resolver = Resolver(buggery.global_layout, layout, False)
 
-    # Add the globals
-    if self.name != 'startup':
-      inited_vars = inited_vars.union(buggery.get_global_variable_names())
-
-    # Check
+    self.layout = resolver.locals
+    for p in self.params:
+      p.resolve(resolver)
+    for a in self.annotations:
+      a.resolve(resolver)
     for st in self.subtasks:
-      for var in st.uses():
-        if var not in inited_vars:
-          raise UserError ("Variable %s is used uninitialized" % var, st)
-
-      # Add defined variables
-      inited_vars = inited_vars.union(st.defs())
+      st.resolve(resolver)
 
+    self.retval_slot = resolver.read("RETVAL")
 
 
 class PythonTask(Task):
-  def __init__(self, name, function):
+  """A task which calls a Python function: a builtin, one registered with
+  Buggery.register, or one from the script's sidecar module. The arguments
+  are passed as strings, or as the Data themselves if TAKES_DATA. If
+  RETURNS_VALUE, the function's result is the task's, converted by to_data."""
+  __slots__ = ('function', 'returns_value', 'takes_data')
+
+  def __init__(self, name, function, returns_value=True, takes_data=False):
     super(PythonTask, self).__init__(name)
     self.function = function
+    self.returns_value = returns_value
+    self.takes_data = takes_data
 
   def run(self, buggery, actuals, caller):
-    vals = [actual.as_string() for actual in actuals]
-    return self.function(*vals)
-
-  def param_count(self):
-    (args, varargs, varkw, defaults) = inspect.getargspec(self.function)
-    return len(args)
+    if self.takes_data:
+      vals = actuals
+    else:
+      vals = [actual.as_string() for actual in actuals]
+    result = self.function(*vals)
+    if self.returns_value:
+      return to_data(result)
+
+  def summarize(self):
+    import inspect # slow to import, and only needed here
+    import functools
+
+    # Arguments which are already bound aren't ours to pass
+    function = self.function
+    bound = 0
+    keywords = set()
+    while True:
+      if isinstance(function, functools.partial):
+        bound += len(function.args)
+        keywords.update((function.keywords or {}).keys())
+        function = function.func
+      elif inspect.ismethod(function):
+        if function.im_self is not None:
+          bound += 1
+        function = function.im_func
+      else:
+        break
 
-  def required_param_count(self):
-    (args, varargs, varkw, defaults) = inspect.getargspec(self.function)
-    count = len(args)
-    if defaults: # this can be None
-      count -= len(defaults)
+    try:
+      (args, varargs, varkw, defaults) = inspect.getargspec(function)
+    except TypeError:
+      # Builtins and other callables can't be inspected, so allow anything
+      return TaskSummary([], self.returns_value, sys.maxint, 0)
 
-    return count
+    required = args[:len(args) - len(defaults or ())][bound:]
+    args = args[bound:]
+    required = [arg for arg in required if arg not in keywords]
+    args = [arg for arg in args if arg not in keywords]
 
-  def defs(self):
-    return []
+    # Any number of arguments can go to *args
+    return TaskSummary([], self.returns_value, sys.maxint if varargs else len(args), len(required))
 
 
 class Assignment(Subtask):
+  __slots__ = ('lvalue', 'rvalue', 'slot')
+  fields = ('lvalue', 'rvalue')
+  children = ('rvalue',)
+
   def __init__(self, lvalue, rvalue):
     bgrassert (not isinstance (rvalue, str))
     self.lvalue = lvalue
@@ -539,7 +863,11 @@ class Assignment(Subtask):
 
   def eval(self, buggery):
     result = self.rvalue.eval(buggery)
-    buggery.set_var(self.lvalue, result)
+    buggery.store(self.slot, result)
+
+  def resolve(self, resolver):
+    self.slot = resolver.write(self.lvalue)
+    self.rvalue.resolve(resolver)
 
   def uses(self):
     return self.rvalue.uses()
@@ -547,13 +875,54 @@ class Assignment(Subtask):
   def defs(self):
     return [self.lvalue]
 
+  def calls(self):
+    if isinstance(self.rvalue, Subtask):
+      return self.rvalue.calls()
+    return []
+
+
+class Thunk(object):
+  """A startup assignment which hasn't run yet, with --lazy-startup. It sits in
+  its global's slot until the global is read, when it runs, with the globals
+  as its frame, and replaces itself with the result."""
+  __slots__ = ('assignment', 'lock', 'value')
+
+  def __init__(self, assignment):
+    self.assignment = assignment
+    self.lock = threading.Lock()
+    self.value = None
+
+  def force(self, buggery):
+    # Other threads wait while it runs. A thunk never reads itself, so reading
+    # other globals from here can't deadlock.
+    with self.lock:
+      if self.value is None:
+        stack = buggery.stack
+        stack.append(buggery.globals)
+        try:
+          self.assignment.eval(buggery)
+        finally:
+          stack.pop()
+        self.value = buggery.globals[self.assignment.slot[1]]
+    return self.value
+
 
 class Command(Subtask):
+  __slots__ = ('command', 'stdin_var', 'stdin_slot', 'simple')
+  fields = ('command', 'stdin_var')
+
   def __init__(self, command, stdin_var):
     self.command = command
     self.stdin_var = stdin_var
+    # Whether the command might be run without the shell
+    self.simple = command.is_simple()
 
   def eval(self, buggery):
+    if buggery.profiler:
+      return buggery.profiler.call('command', self.command, (self.lineno, self.colno), lambda: self.execute(buggery))
+    return self.execute(buggery)
+
+  def execute(self, buggery):
     command = self.command.interpolate(buggery, self)
 
     if buggery.options.verbose:
@@ -561,106 +930,316 @@ class Command(Subtask):
 
     stdin_str, stdin_proc = None, None
     if self.stdin_var:
-      stdin_str = buggery.get_var(self.stdin_var, self).as_string()
-      stdin_proc = subprocess.PIPE
-
-
-    class ThreadWorker(threading.Thread):
-      def __init__(self, pipe, debug_target):
-        super(ThreadWorker, self).__init__()
-        self.all = ""
-        self.pipe = pipe
-        self.debug_target = debug_target
-        self.setDaemon(True)
-
-      def run(self):
-        while True:
-          line = self.pipe.readline()
-          if line == '': break
-          else:
-            self.all += line
+      (stdin_str, stdin_proc) = stdin_source(buggery.load(self.stdin_slot, self.stdin_var, self))
+
+    limit = buggery.options.capture_limit or None
+    stdout, stderr = procio.Capture(limit), procio.Capture(limit)
+    # Inside a parallel group, don't start anything once a sibling has failed,
+    # and let the group kill us if one fails while we're running.
+    group = buggery.group
+    if group and group.is_cancelled():
+      raise parallel.Cancelled()
+
+    # The shell co-process can't give the command stdin, or let a group kill
+    # it on its own.
+    coprocess = buggery.coprocess
+    if coprocess and not self.stdin_var and not group and coprocess.acquire():
+      try:
+        exit_code = coprocess.run(command, stdout, stderr, echo=buggery.options.verbose)
+        (pid, rusage) = (coprocess.pid, None)
+      finally:
+        coprocess.release()
 
-            if buggery.options.verbose:
-              self.debug_target.write(line)
-              self.debug_target.flush()
+    else:
+      try:
+        try:
+          proc = procio.popen(command, self.simple, own_group=bool(group),
+                              stdin=stdin_proc, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        finally:
+          close_stdin_source(stdin_proc)
+        if group:
+          group.start(proc)
+        try:
+          procio.communicate(proc, stdin_str, stdout, stderr, echo=buggery.options.verbose)
+        finally:
+          if group:
+            group.finish(proc)
+
+      except KeyboardInterrupt, e:
+        pass
+
+      (exit_code, pid, rusage) = (proc.returncode, proc.pid, getattr(proc, 'rusage', None))
 
+    result = ProcData(command=command,
+                      stdin=stdin_str,
+                      stdout=stdout,
+                      stderr=stderr,
+                      exit_code=exit_code,
+                      pid=pid,
+                      rusages=[rusage])
 
-    try:
-      proc = subprocess.Popen(command, stdin=stdin_proc, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    if exit_code != 0:
+      raise CommandError(result)
+    return result
 
-      if stdin_str:
-        proc.stdin.write(stdin_str)
-        proc.stdin.close()
+  def resolve(self, resolver):
+    self.command.resolve(resolver)
+    self.stdin_slot = resolver.read(self.stdin_var) if self.stdin_var else None
 
-      stdout_worker = ThreadWorker(proc.stdout, sys.stdout)
-      stderr_worker = ThreadWorker(proc.stderr, sys.stderr)
-      stdout_worker.start()
-      stderr_worker.start()
+  def uses(self):
+    uses = self.command.uses()
+    if self.stdin_var:
+      uses = list(set(uses + [self.stdin_var]))
+    return uses
 
-      while proc.poll() is None:
-        time.sleep(0.05)
+  def defs(self):
+    return set()
 
-      stdout_worker.join()
-      stderr_worker.join()
+
+class Pipeline(Subtask):
+  """Commands which each stream their output into the next, written
+  `$ a |> b |> c`. Each stage runs in its own process, connected to the next
+  by an OS pipe, so they run concurrently and only the output of the last
+  stage is captured. When the pipeline is on a line of its own, nothing can use
+  that output, so it isn't kept at all (unless running verbosely)."""
+  __slots__ = ('stages', 'stdin_var', 'discard_output', 'stdin_slot', 'simple')
+  fields = ('stages', 'stdin_var', 'discard_output')
+
+  def __init__(self, stages, stdin_var):
+    self.stages = stages
+    self.stdin_var = stdin_var
+    self.discard_output = False
+    self.simple = [stage.is_simple() for stage in stages]
+
+  def eval(self, buggery):
+    if buggery.profiler:
+      name = " |> ".join(self.stages)
+      return buggery.profiler.call('command', name, (self.lineno, self.colno), lambda: self.execute(buggery))
+    return self.execute(buggery)
+
+  def execute(self, buggery):
+    commands = [stage.interpolate(buggery, self) for stage in self.stages]
+    command = " |> ".join(commands)
+    verbose = buggery.options.verbose
+
+    if verbose:
+      print "    $ " + command
+
+    stdin_str, stdin_proc = None, None
+    if self.stdin_var:
+      (stdin_str, stdin_proc) = stdin_source(buggery.load(self.stdin_slot, self.stdin_var, self))
+
+    limit = buggery.options.capture_limit or None
+    stdout, stderr = procio.Capture(limit), procio.Capture(limit)
+    group = buggery.group
+    if group and group.is_cancelled():
+      raise parallel.Cancelled()
+
+    procs = []
+    devnull = None
+    try:
+      try:
+        for (i, stage) in enumerate(commands):
+          if i == len(commands) - 1 and self.discard_output and not verbose:
+            devnull = open(os.devnull, 'w')
+            stage_stdout = devnull
+          else:
+            stage_stdout = subprocess.PIPE
+
+          # Only the next stage should hold the read end of the pipe, so close
+          # our copy (and don't let the stages inherit each other's pipes).
+          stage_stdin = procs[-1].stdout if procs else stdin_proc
+          proc = procio.popen(stage, self.simple[i], own_group=bool(group), stdin=stage_stdin, stdout=stage_stdout,
+                              stderr=subprocess.PIPE, close_fds=True, preexec_fn=procio.restore_sigpipe)
+          if procs:
+            procs[-1].stdout.close()
+          procs.append(proc)
+          if group:
+            group.start(proc)
+
+        outputs = [(procs[-1].stdout, stdout, sys.stdout if verbose else None)]
+        outputs += [(proc.stderr, stderr, sys.stderr if verbose else None) for proc in procs]
+        procio.pump(procs[0].stdin, stdin_str, outputs)
+        for proc in procs:
+          procio.wait(proc)
+      finally:
+        if group:
+          for proc in procs:
+            group.finish(proc)
+        if devnull:
+          devnull.close()
+        close_stdin_source(stdin_proc)
 
     except KeyboardInterrupt, e:
       pass
 
+    # A stage which was killed because a later stage stopped reading its
+    # output hasn't failed (the shell reports that as 128 + SIGPIPE).
+    # Otherwise, the last failure counts, as with bash's pipefail.
+    exit_codes = [proc.returncode for proc in procs]
+    for i in range(len(exit_codes) - 1):
+      if exit_codes[i] in (-signal.SIGPIPE, 128 + signal.SIGPIPE):
+        exit_codes[i] = 0
+    failures = [code for code in exit_codes if code != 0]
+
     result = ProcData(command=command,
                       stdin=stdin_str,
-                      stdout=stdout_worker.all.strip(),
-                      stderr=stderr_worker.all.strip(),
-                      exit_code=proc.returncode,
-                      pid=proc.pid)
-
-    if proc.returncode != 0:
+                      stdout=stdout,
+                      stderr=stderr,
+                      exit_code=failures[-1] if failures else 0,
+                      exit_codes=exit_codes,
+                      pid=procs[-1].pid,
+                      rusages=[getattr(proc, 'rusage', None) for proc in procs])
+
+    if failures:
       raise CommandError(result)
     return result
 
+  def resolve(self, resolver):
+    for stage in self.stages:
+      stage.resolve(resolver)
+    self.stdin_slot = resolver.read(self.stdin_var) if self.stdin_var else None
+
   def uses(self):
-    return self.command.uses()
+    stdin = [self.stdin_var] if self.stdin_var else []
+    return list(set(sum([stage.uses() for stage in self.stages], stdin)))
 
   def defs(self):
     return set()
 
 
 class Call(Subtask):
+  # TASK is the task called, bound when the script is checked or loaded. It's
+  # not a field, so that describing or printing a recursive call doesn't go on
+  # forever.
+  __slots__ = ('target', 'args', 'task')
+  fields = ('target', 'args')
+  children = ('args',)
+  keeps_going = True
+
   def __init__(self, target, args):
     self.target = target
     self.args = args
+    self.task = None
+
+  # Pickling the task would pickle everything it calls from here, which goes
+  # as deep as the call graph, and the builtins can't be pickled.
+  def __getstate__(self):
+    state = {}
+    for cls in self.__class__.__mro__:
+      for name in getattr(cls, '__slots__', ()):
+        if name != 'task' and hasattr(self, name):
+          state[name] = getattr(self, name)
+    return (None, state)
+
+  def __setstate__(self, state):
+    self.task = None
+    for (name, value) in state[1].items():
+      setattr(self, name, value)
 
   def eval(self, buggery):
     actuals = [arg.eval(buggery) for arg in self.args]
-    return buggery.run(self.target, actuals, self)
+    if self.task is None:
+      return buggery.run(self.target, actuals, self)
+    return buggery.call(self.task, actuals, self)
+
+  def resolve(self, resolver):
+    for arg in self.args:
+      arg.resolve(resolver)
+
+  def uses(self):
+    list = sum ([arg.uses() for arg in self.args], [])
+    return [x for x in set(list)]
+
+  def defs(self):
+    return set()
 
+  def calls(self):
+    return [self]
 
-  def _check(self, buggery):
-    if self.target not in buggery.tasks:
-      raise UserError("Task '%s' not defined" % self.target, self.target)
 
-    arg_count = len(self.args)
-    param_count = buggery.tasks[self.target].param_count()
-    if arg_count > param_count:
-      raise UserError("Task '%s' called with %s arguments, though there are only %s parameters" % (self.target, arg_count, param_count), self)
+class Parallel(Subtask):
+  """A group of calls which run concurrently, written `{a, b, c}`."""
+  __slots__ = ('branches',)
+  fields = ('branches',)
+  children = ('branches',)
+  keeps_going = True
 
-    required_param_count = buggery.tasks[self.target].required_param_count()
-    if arg_count < required_param_count:
-      raise UserError("Task '%s' called with %s arguments, but %s parameters are required" % (self.target, arg_count, required_param_count), self)
+  def __init__(self, branches):
+    self.branches = branches
+
+  def eval(self, buggery):
+    if not buggery.options.keep_going:
+      parallel.run_branches(buggery, [call.eval for call in self.branches])
+      return
+
+    # With -k, a failed branch doesn't cancel the others
+    failed = []
+    def branch(call):
+      def run(buggery):
+        try:
+          call.eval(buggery)
+        except TaskFailed:
+          failed.append(call.target)
+      return run
+
+    parallel.run_branches(buggery, [branch(call) for call in self.branches])
+    if failed:
+      raise TaskFailed(", ".join(failed))
+
+  def resolve(self, resolver):
+    for call in self.branches:
+      call.resolve(resolver)
 
   def uses(self):
-    list = sum ([arg.uses() for arg in self.args], [])
-    return [x for x in set(list)]
+    return list(set(sum([call.uses() for call in self.branches], [])))
 
   def defs(self):
     return set()
 
+  def calls(self):
+    return self.branches
+
+
+class Annotation(Node):
+  """An annotation on a task, eg `@inputs("src/*.c")`. Maps each known
+  annotation to the minimum and maximum number of arguments it takes."""
+  __slots__ = ('name', 'args')
+  fields = ('name', 'args')
+  children = ('args',)
+
+  known = {
+    'inputs': (1, None),
+    'outputs': (1, None),
+    'pure': (0, 0),
+    'dataflow': (0, 0),
+  }
+
+  def __init__(self, name, args):
+    self.name = name
+    self.args = args
+
+  def resolve(self, resolver):
+    for arg in self.args:
+      arg.resolve(resolver)
+
+  def uses(self):
+    return list(set(sum([arg.uses() for arg in self.args], [])))
+
 
 class Variable(Node):
+  __slots__ = ('name', 'slot')
+  fields = ('name',)
+
   def __init__(self, name):
     self.name = name
+    self.slot = None
 
   def eval(self, buggery):
-    return buggery.get_var(self.name, self)
+    return buggery.load(self.slot, self.name, self)
+
+  def resolve(self, resolver):
+    self.slot = resolver.read(self.name)
 
   def uses(self):
     return [self.name]
@@ -668,24 +1247,226 @@ class Variable(Node):
 
 
 class Param(Node):
+  __slots__ = ('name', 'default', 'slot')
+  fields = ('name', 'default')
+  children = ('default',)
+
   def __init__(self, name, default):
     self.name = name
     self.default = default
 
+  def resolve(self, resolver):
+    self.slot = resolver.write(self.name)
+    if self.default:
+      self.default.resolve(resolver)
+
+
+class Resolver(object):
+  """Maps variable names to slots while resolving a task. A slot is a pair of
+  (is_global, index into the frame). Globals take precedence over locals when
+  reading, as they always have. LOCALS is the task's own layout, which for
+  startup is the global layout."""
+
+  def __init__(self, globals, locals, is_startup):
+    self.globals = globals
+    self.locals = locals
+    self.is_startup = is_startup
+
+  def read(self, name):
+    if name in self.globals:
+      return (True, self.globals[name])
+    if name in self.locals:
+      return (self.is_startup, self.locals[name])
+    # Unknown, so it's looked up by name and reported at run-time
+    return None
+
+  def write(self, name):
+    return (self.is_startup, self.locals[name])
+
+
+class RespondFalse(object):
+  def __getattr__(*args, **kwargs):
+    return False
+
+
+class Checker(object):
+  """Checks each task in a script. Each kind of subtask is checked by its own
+  method, and what we need to know about called tasks comes from their
+  summaries.
+
+  A task's check only depends on its own definition, the global variables,
+  and the summaries of the tasks it calls, so its check key hashes those. A
+  task whose key matches one from an earlier check doesn't need checking
+  again."""
+
+  def __init__(self, buggery):
+    self.buggery = buggery
+    self.globals = set(buggery.get_global_variable_names())
+    self.visitors = {
+      Assignment: self.check_assignment,
+      Command: self.check_command,
+      Pipeline: self.check_pipeline,
+      Call: self.check_call,
+      Parallel: self.check_parallel,
+    }
+
+  def check(self, verified):
+    keys = set()
+    for task in self.buggery.tasks.values():
+      if isinstance(task, BuggeryTask):
+        key = self.check_key(task)
+        if key not in verified:
+          self.check_task(task)
+        keys.add(key)
+    return keys
+
+  def check_key(self, task):
+    tasks = self.buggery.tasks
+    callees = [(name, tasks[name].summary().key() if name in tasks else None) for name in task.callees()]
+    # Hashing the text is much cheaper than describing the task
+    definition = self.buggery.source_digests.get(task.key) or describe(task)
+    return hashlib.sha1(repr((definition, sorted(self.globals), callees))).hexdigest()
+
+
+  def check_task(self, task):
+    if len(task.subtasks) == 0:
+      raise UserError ("Task %s has no subtasks" % task.name, task)
+
+    # We can statically check all uninitialized variables, since the control flow is linear.
+    inited_vars = set([p.name for p in task.params])
+    if task.name != 'startup':
+      inited_vars |= self.globals
+
+    # Annotations are evaluated once the parameters are set
+    for a in task.annotations:
+      self.check_annotation(a)
+      self.check_uses(a, inited_vars)
+
+    for st in task.subtasks:
+      self.check_uses(st, inited_vars)
+      self.visitors[type(st)](st)
+      inited_vars |= set(st.defs())
+
+  def check_uses(self, node, inited_vars):
+    for var in node.uses():
+      if var not in inited_vars:
+        raise UserError ("Variable %s is used uninitialized" % var, node)
+
+  def check_annotation(self, annotation):
+    if annotation.name not in Annotation.known:
+      raise UserError("Unknown annotation '@%s'" % annotation.name, annotation)
+
+    (min, max) = Annotation.known[annotation.name]
+    if len(annotation.args) < min or (max is not None and len(annotation.args) > max):
+      raise UserError("Annotation '@%s' called with %s arguments" % (annotation.name, len(annotation.args)), annotation)
+
+  def check_assignment(self, assignment):
+    rvalue = assignment.rvalue
+    if isinstance(rvalue, Call):
+      self.check_call(rvalue)
+      if not self.buggery.get_task(rvalue.target).summary().returns_value:
+        raise UserError ("Task %s does not return a value" % rvalue.target, rvalue)
+    elif type(rvalue) in self.visitors:
+      self.visitors[type(rvalue)](rvalue)
+
+  def check_command(self, command):
+    pass
+
+  def check_pipeline(self, pipeline):
+    if '' in pipeline.stages:
+      raise UserError("Empty stage in pipeline", pipeline)
+
+  def check_call(self, call):
+    if call.target not in self.buggery.tasks:
+      raise UserError("Task '%s' not defined" % call.target, call.target)
+
+    summary = self.buggery.tasks[call.target].summary()
+    arg_count = len(call.args)
+    if arg_count > summary.param_count:
+      raise UserError("Task '%s' called with %s arguments, though there are only %s parameters" % (call.target, arg_count, summary.param_count), call)
+
+    if arg_count < summary.required_param_count:
+      raise UserError("Task '%s' called with %s arguments, but %s parameters are required" % (call.target, arg_count, summary.required_param_count), call)
+
+  def check_parallel(self, parallel):
+    for call in parallel.branches:
+      self.check_call(call)
+
+
+def describe(obj):
+  """A description of an AST node which doesn't change if the node merely
+  moves around in the file: the class and fields of each node."""
+  if isinstance(obj, (Node, Data)):
+    fields = [(k, describe(getattr(obj, k, None))) for k in obj.fields]
+    return (obj.__class__.__name__, fields)
+
+  if isinstance(obj, (list, tuple, set)):
+    return [describe(elem) for elem in obj]
+
+  return obj
+
 
 class Buggery(Node):
+  # Buggery objects have lots of run-time state, and there are only a few (one
+  # for each run), so they keep a __dict__.
+  children = ('tasks',)
+
   def __init__(self, task_list):
     self.tasks = lcdict()
     self.add_tasks (task_list)
-    self.stack = []
-    self.globals = self.StackFrame()
+    self.global_layout = {}
+    self.source_digests = {}
     self.add_builtins()
-
-    class RespondFalse(object):
-      def __getattr__(*args, **kwargs):
-        return False
-
     self.options = RespondFalse()
+    self.stamps = None
+    self.reset_run_state()
+
+  # Checked scripts are pickled by the script cache. Only the parsed tasks are
+  # saved; the builtins and the run-time state are recreated on load.
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['tasks'] = lcdict([(name, task) for (name, task) in self.tasks.items() if not isinstance(task, PythonTask)])
+    for key in ['_local', 'globals', 'options', 'stamps', 'profiler', 'coprocess', 'job_slots', 'memo', 'memo_lock', 'memo_hits', 'memo_misses', 'failures', 'failures_lock']:
+      del state[key]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.add_builtins()
+    self.bind_calls()
+    self.options = RespondFalse()
+    self.stamps = None
+    self.reset_run_state()
+
+  def reset_run_state(self):
+    """Start afresh the state which belongs to one run of the script: the
+    stacks, the globals, memoized results, failures and the slots for
+    parallel branches."""
+    self._local = threading.local()
+    self.globals = self.StackFrame(self.global_layout)
+    self.profiler = None
+    self.coprocess = None
+    self.job_slots = None
+    self.reset_memo()
+    self.reset_failures()
+
+  def spawn(self):
+    """A copy of the script for another run, which can go on at the same time
+    as this one. The copy shares the checked tasks, the options and the stamp
+    database, but has run-time state of its own."""
+    copy = Buggery.__new__(Buggery)
+    copy.__dict__.update(self.__dict__)
+    copy.tasks = lcdict(self.tasks.items())
+    copy.reset_run_state()
+    return copy
+
+  def run_async(self, taskname, args=[]):
+    """Start running the task TASKNAME on a thread of its own, with startup
+    and shutdown around it as bugger does, and return a runner.Run to follow
+    it. The run uses a spawned copy of the script, so any number can go on at
+    once. ARGS are Data objects or plain strings."""
+    args = [arg if isinstance(arg, Data) else StringData(BStr.literal(arg)) for arg in args]
+    return runner.Run(self.spawn(), taskname, args)
 
 
   def add_tasks(self, task_list):
@@ -702,54 +1483,202 @@ class Buggery(Node):
   def get_task(self, name):
     return self.tasks[name]
 
-  def check(self):
-    self.traverse("_check", self)
-
-    if len(self.tasks) == self.num_builtins:
+  def register(self, name, function, returns_value=True):
+    """Make the Python FUNCTION callable as the task NAME. Calls to it are
+    checked, so register functions before the script is checked, eg between
+    Parser.parse_tasks() and check()."""
+    self.add_task(PythonTask(name, function, returns_value))
+    self.bind_calls()
+
+  def load_sidecar(self, filename):
+    """Register each public function of the sidecar module of the script
+    FILENAME, such as build.py for build.bgr, if it has one."""
+    path = sidecar_filename(filename)
+    if path is None or not os.path.exists(path):
+      return
+
+    module = load_module(path)
+    for (name, value) in sorted(vars(module).items()):
+      if isinstance(value, types.FunctionType) and value.__module__ == module.__name__ and not name.startswith('_'):
+        self.add_task(PythonTask(name, value))
+    self.bind_calls()
+
+  def check(self, verified=()):
+    """Check the script, then bind its variables. Tasks whose check key is in
+    VERIFIED passed an earlier check unchanged, and aren't checked again. The
+    keys of all the tasks are kept in check_keys."""
+    self.check_keys = Checker(self).check(verified)
+
+    if not [task for task in self.tasks.values() if isinstance(task, BuggeryTask)]:
       raise UserError("No tasks defined", None)
 
-  class StackFrame(dict):
-    pass
+    self.resolve_variables()
+
+  def resolve_variables(self):
+    # The layout of the globals is needed to resolve any task
+    self.global_layout = {}
+    if 'startup' in self.tasks:
+      startup = self.tasks['startup']
+      for name in [p.name for p in startup.params] + startup.summary().defs:
+        self.global_layout.setdefault(name, len(self.global_layout))
+    self.globals = self.StackFrame(self.global_layout)
+
+    for task in self.tasks.values():
+      if isinstance(task, BuggeryTask):
+        task.resolve_variables(self)
+    self.bind_calls()
+
+  def bind_calls(self):
+    """Point each call at the task it calls, so that calls needn't look their
+    targets up by name."""
+    for task in self.tasks.values():
+      if isinstance(task, BuggeryTask):
+        for st in task.subtasks:
+          for call in st.calls():
+            call.task = self.tasks.get(call.target)
+
+  class StackFrame(list):
+    """The variables of a running task, indexed by slot. LAYOUT maps their
+    names to their slots."""
+    def __init__(self, layout):
+      list.__init__(self, [None] * len(layout))
+      self.layout = layout
+
+  # Each thread running branches of a parallel group has its own stack, and
+  # knows which group it is running in.
+  @property
+  def stack(self):
+    if not hasattr(self._local, 'stack'):
+      self._local.stack = []
+    return self._local.stack
+
+  @stack.setter
+  def stack(self, stack):
+    self._local.stack = stack
+
+  @property
+  def group(self):
+    return getattr(self._local, 'group', None)
+
+  @group.setter
+  def group(self, group):
+    self._local.group = group
 
 
   def run(self, taskname, args, caller=None):
 
-    if taskname not in self.tasks:
+    task = self.tasks.get(taskname)
+    if task is None:
       raise UserError ("No task '%s' defined" % taskname, None)
 
-    task = self.tasks[taskname]
+    return self.call(task, args, caller)
+
+  def call(self, task, args, caller=None):
+    if self.profiler:
+      return self.profiler.call('task', task.name, None, lambda: self.dispatch(task, args, caller))
+    return self.dispatch(task, args, caller)
+
+  def dispatch(self, task, args, caller=None):
+    if task.is_pure():
+      return self.run_pure(task, args, caller)
 
+    return self.run_task(task, args, caller)
+
+
+  def run_task(self, task, args, caller=None):
     # New stackframe and copy parameters
-    use_globals = (taskname == "startup")
-    frame = self.StackFrame() if not use_globals else self.globals
-    self.stack.insert(0, frame)
+    use_globals = (task.name == "startup")
+    frame = self.StackFrame(task.layout) if not use_globals else self.globals
+    stack = self.stack
+    stack.append(frame)
 
     # Run the task itself
-    result = task.run(self, args, caller)
+    try:
+      return task.run(self, args, caller)
+    finally:
+      # Pop the stackframe
+      stack.pop()
 
-    # Pop the stackframe
-    self.stack.pop(0)
 
-    return result
+  # Tasks annotated with @pure are only run once for each set of arguments.
+  def run_pure(self, task, args, caller=None):
+    key = (task.key, tuple([arg.as_string() for arg in args]))
+    with self.memo_lock:
+      if key in self.memo:
+        self.memo_hits += 1
+        if self.options.verbose:
+          print "Memoized: %s %s" % (task.name, " ".join(key[1]))
+        return self.memo[key]
 
+    result = self.run_task(task, args, caller)
 
-  def get_var(self, name, stateobj=None):
-    if name in self.globals:
-      return self.globals[name]
+    with self.memo_lock:
+      self.memo_misses += 1
+      self.memo[key] = result
 
-    if name in self.stack[0]:
-      return self.stack[0][name]
+    return result
 
-    raise UserError ("Unknown variable: %s" % name, stateobj)
+  # With -k, failed commands are recorded as (task, subtask, ProcData), and the
+  # run carries on.
+  def record_failure(self, task, subtask, proc):
+    with self.failures_lock:
+      self.failures.append((task, subtask, proc))
+
+  def reset_failures(self):
+    self.failures = []
+    self.failures_lock = threading.Lock()
+
+  def memo_report(self):
+    return "Memoized calls: %d hits, %d misses" % (self.memo_hits, self.memo_misses)
+
+  def reset_memo(self):
+    self.memo = {}
+    self.memo_lock = threading.Lock()
+    self.memo_hits = 0
+    self.memo_misses = 0
+
+
+  # Variables are accessed through the slots assigned by resolve_variables. A
+  # variable which couldn't be resolved has no slot, and is looked up by name.
+  def load(self, slot, name, stateobj=None):
+    if slot is None:
+      return self.get_var(name, stateobj)
+
+    (is_global, index) = slot
+    value = (self.globals if is_global else self.stack[-1])[index]
+    if value is None:
+      raise UserError ("Unknown variable: %s" % name, stateobj)
+    if value.__class__ is Thunk:
+      return value.force(self)
+    return value
+
+  def peek(self, slot):
+    """The value in SLOT, or None if it hasn't been set."""
+    (is_global, index) = slot
+    value = (self.globals if is_global else self.stack[-1])[index]
+    if value.__class__ is Thunk:
+      return value.force(self)
+    return value
 
   # There's no need for checking here, since all variable and global names are statically known, and can be statically checked.
-  def set_var(self, name, value):
+  def store(self, slot, value):
     bgrassert (isinstance (value, Data))
-    self.stack[0][name] = value
+    (is_global, index) = slot
+    (self.globals if is_global else self.stack[-1])[index] = value
+
+  def get_var(self, name, stateobj=None):
+    if name in self.global_layout and self.globals[self.global_layout[name]] is not None:
+      return self.load((True, self.global_layout[name]), name, stateobj)
+
+    frame = self.stack[-1]
+    if name in frame.layout and frame[frame.layout[name]] is not None:
+      return frame[frame.layout[name]]
+
+    raise UserError ("Unknown variable: %s" % name, stateobj)
 
   def get_global_variable_names(self):
     if 'startup' in self.tasks:
-      return self.tasks['startup'].defs()
+      return self.tasks['startup'].summary().defs
 
     return []
 
@@ -769,19 +1698,17 @@ class Buggery(Node):
     def builtin_pass ():
       pass
 
-    def builtin_save(filename, string):
-      import os.path
-      file(os.path.expanduser(filename), 'w').write(string)
+    # These write a command's output exactly as it was printed
+    def builtin_save(filename, data):
+      write_data(filename, data, 'wb')
 
-    def builtin_append(filename, string):
-      import os.path
-      file(os.path.expanduser(filename), 'a').write(string)
+    def builtin_append(filename, data):
+      write_data(filename, data, 'ab')
 
-    self.add_task (PythonTask("print", builtin_print))
-    self.add_task (PythonTask("save", builtin_save))
-    self.add_task (PythonTask("append", builtin_append))
-    self.add_task (PythonTask("pass", builtin_pass))
-    self.num_builtins = 4
+    self.add_task (PythonTask("print", builtin_print, returns_value=False))
+    self.add_task (PythonTask("save", builtin_save, returns_value=False, takes_data=True))
+    self.add_task (PythonTask("append", builtin_append, returns_value=False, takes_data=True))
+    self.add_task (PythonTask("pass", builtin_pass, returns_value=False))
 
   def has_task(self, name):
     return name in self.tasks
@@ -789,49 +1716,221 @@ class Buggery(Node):
 
 
 class BStr(str):
-  """Buggery string, the base for all strings, is interpolable"""
+  """Buggery string, the base for all strings, is interpolable.
+
+  The string is split into a template when it is created: `parts` alternates
+  literal text and the names of interpolated variables, so "a@Xb" becomes
+  ['a', 'X', 'b']. A string with no variables has a single part."""
+
+  # For string interpolation, using the @ symbol. A regex is sufficient for this.
+  # TODO handle complex interpolation ("@{...}")
+  interpolation_re = re.compile(r'@(' + Parser.var_syntax + ')')
+
+  def __new__(cls, value):
+    self = str.__new__(cls, value)
+    self.parts = cls.interpolation_re.split(self)
+    self.slots = None
+    return self
+
+  @classmethod
+  def literal(cls, value):
+    """A string which is never interpolated, such as the result of an interpolation."""
+    self = str.__new__(cls, value)
+    self.parts = [value]
+    self.slots = None
+    return self
+
+  def resolve(self, resolver):
+    self.slots = [resolver.read(name) for name in self.parts[1::2]]
+
+  def is_simple(self):
+    """Whether the literal text of this string, used as a command, doesn't
+    need the shell. The interpolated values still need checking."""
+    return not procio.needs_shell(''.join(self.parts[0::2]))
+
+  def is_constant(self):
+    return len(self.parts) == 1
 
   def interpolate(self, buggery, stateobj=None):
-    # TODO handle complex interpolation ("@{...}")
+    if len(self.parts) == 1:
+      return self
 
-    # For string interpolation, using the @ symbol. A regex is sufficient for this.
-    return re.sub(r'@' + Parser.var_syntax + '',
-                  lambda m: buggery.get_var(m.group(0)[1:], stateobj).as_string(),
-                  self)
+    values = self.parts[:]
+    slots = self.slots or [None] * (len(values) // 2)
+    for i in range(1, len(values), 2):
+      values[i] = buggery.load(slots[i // 2], values[i], stateobj).as_string()
+    return ''.join(values)
 
   def uses(self):
-    return re.findall (r'@(' + Parser.var_syntax + ')', self)
+    return self.parts[1::2]
+
+
+
+
+
+def sidecar_filename(filename):
+  """The sidecar module of the script FILENAME: the same name, ending in .py
+  instead of the script's own extension."""
+  path = os.path.splitext(filename)[0] + '.py'
+  return path if path != filename else None
+
+
+def load_module(path):
+  """Import the Python file PATH, under a name which can't clash with a real
+  module, and without leaving a .pyc beside it."""
+  name = 'buggery_sidecar_' + hashlib.sha1(os.path.abspath(path)).hexdigest()[:12]
+  # Reloading into the old module would keep functions which have gone
+  sys.modules.pop(name, None)
+  dont_write_bytecode = sys.dont_write_bytecode
+  sys.dont_write_bytecode = True
+  try:
+    return imp.load_source(name, path)
+  finally:
+    sys.dont_write_bytecode = dont_write_bytecode
+
+
+def to_data(value):
+  """Convert what a Python function returned into Data. Strings are used as
+  they are, booleans become "true" or "false", lists and tuples have one item
+  per line, and anything else is converted with str()."""
+  if isinstance(value, Data):
+    return value
+  if value is None:
+    value = ""
+  elif isinstance(value, bool):
+    value = "true" if value else "false"
+  elif isinstance(value, unicode):
+    value = value.encode('utf-8')
+  elif isinstance(value, (list, tuple)):
+    value = "\n".join([str(v) for v in value])
+  return StringData(BStr.literal(str(value)))
 
 
+def stdin_source(value):
+  """How to give the Data VALUE to a command as its stdin: a (data, stdin)
+  pair, where STDIN is for Popen and DATA is to be written to the pipe. Output
+  which spilled to a file is given as the file itself, so it isn't copied."""
+  f = value.as_file()
+  if f:
+    return (None, f)
+  return (value.as_bytes(), subprocess.PIPE)
 
 
+def close_stdin_source(stdin):
+  """Close our copy of a file from stdin_source, once the command has it."""
+  if isinstance(stdin, file):
+    stdin.close()
+
+
+def write_data(filename, data, mode):
+  f = file(os.path.expanduser(filename.as_string()), mode)
+  try:
+    data.write_to(f)
+  finally:
+    f.close()
+
 
 class Data(object):
-  pass
+  __slots__ = ()
+  fields = ()
+
+  def as_bytes(self):
+    """The value exactly, for a command's stdin or save(). Only a command's
+    output differs from as_string(), which strips it."""
+    return self.as_string()
+
+  def as_file(self):
+    """An open file holding as_bytes(), if the value is kept in a file, or
+    None."""
+    return None
+
+  def write_to(self, f):
+    f.write(self.as_bytes())
+
 
 class ProcData(Data):
-  def __init__(self, command=None, stdin=None, stdout=None, exitcode=None, stderr=None, pid=None, exit_code=None):
+  """The result of a command. STDOUT and STDERR are kept as the command wrote
+  them, as strings or procio.Capture objects. Scripts mostly use them as text,
+  stripped of surrounding whitespace, which is only made when first used; a
+  command's stdin and save() get the output exactly, straight from the
+  capture."""
+
+  def __init__(self, command=None, stdin=None, stdout=None, exitcode=None, stderr=None, pid=None, exit_code=None, exit_codes=None, rusages=None):
     self.command = command
     self.stdin = stdin
-    self.stdout = stdout
-    self.stderr = stderr
+    self._stdout = stdout
+    self._stderr = stderr
+    self._stdout_text = None
+    self._stderr_text = None
     self.exit_code = exit_code
+    self.exit_codes = exit_codes # each stage's, for pipelines
+    self.rusages = rusages # each process's resource usage, if known
+    self.stdout_bytes = self.size(stdout)
+    self.stderr_bytes = self.size(stderr)
     self.pid = pid
 
+  @staticmethod
+  def size(output):
+    """The number of bytes of OUTPUT written, before stripping."""
+    if isinstance(output, procio.Capture):
+      return output.size
+    return len(output or '')
+
+  @staticmethod
+  def raw(output):
+    if isinstance(output, procio.Capture):
+      return output.getvalue()
+    return output or ''
+
+  @property
+  def stdout(self):
+    if self._stdout_text is None:
+      self._stdout_text = self.raw(self._stdout).strip()
+    return self._stdout_text
+
+  @property
+  def stderr(self):
+    if self._stderr_text is None:
+      self._stderr_text = self.raw(self._stderr).strip()
+    return self._stderr_text
+
   def eval(self, buggery):
     return self
 
   def as_string(self):
     return self.stdout
 
+  def as_bytes(self):
+    return self.raw(self._stdout)
+
+  def as_file(self):
+    if isinstance(self._stdout, procio.Capture):
+      return self._stdout.open()
+    return None
+
+  def write_to(self, f):
+    if isinstance(self._stdout, procio.Capture):
+      self._stdout.write_to(f)
+    else:
+      f.write(self.as_bytes())
+
 
 class StringData(Data):
+  # Strings appear in the AST, and the parser gives them a position
+  __slots__ = ('string', 'lineno', 'colno')
+  fields = ('string',)
+
   def __init__(self, string):
     bgrassert (isinstance(string, BStr))
     self.string = string
 
   def eval(self, buggery):
-    return StringData(BStr(self.string.interpolate(buggery)))
+    if self.string.is_constant():
+      return self
+    return StringData(BStr.literal(self.string.interpolate(buggery)))
+
+  def resolve(self, resolver):
+    self.string.resolve(resolver)
 
   def uses(self):
     return self.string.uses()
@@ -0,0 +1,146 @@
+"""Running commands in one long-lived shell, with `bugger --coprocess`.
+
+Starting a process for every `$` line is most of the cost of scripts which
+run lots of tiny commands. In this mode we start a single /bin/sh, and send it
+each command as a line like:
+
+  ( eval '<command>' ) </dev/null; printf '%d\\n' $? >&3
+
+The command runs in a subshell, so `cd`s and variables don't leak from one
+command to the next, just as when each has a process of its own. Its stdout
+and stderr arrive on the shell's stdout and stderr, and its exit status on
+fd 3, which ends the command: by the time the status is written, the subshell
+has exited, so whatever is left in the stdout and stderr pipes is the rest of
+its output.
+
+Commands run this way get /dev/null as their stdin, since the shell's stdin
+carries the commands. Commands which take stdin from a variable, pipelines,
+and commands in parallel groups (which must be killable on their own, and
+mustn't queue up behind each other) get a process of their own as usual.
+"""
+
+import os
+import sys
+import errno
+import fcntl
+import threading
+import subprocess
+
+import procio
+
+
+def frame(command):
+  quoted = "'" + command.replace("'", "'\\''") + "'"
+  return "( eval %s ) </dev/null; printf '%%d\\n' $? >&3\n" % quoted
+
+
+class Coprocess(object):
+  """A shell which runs commands for us, one at a time."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.proc = None
+    self.status_fd = None
+
+  @property
+  def pid(self):
+    return self.proc.pid if self.proc else None
+
+  def start(self):
+    (read_fd, write_fd) = os.pipe()
+    def give_status_fd():
+      os.dup2(write_fd, 3)
+
+    self.proc = subprocess.Popen(['/bin/sh'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 preexec_fn=give_status_fd)
+    os.close(write_fd)
+    self.status_fd = read_fd
+    fcntl.fcntl(read_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+    for fd in [self.proc.stdout.fileno(), self.proc.stderr.fileno(), self.status_fd]:
+      procio.set_nonblocking(fd)
+
+  def close(self):
+    if self.proc:
+      try:
+        self.proc.stdin.close()
+        self.proc.wait()
+      except (IOError, OSError):
+        pass
+      os.close(self.status_fd)
+      self.proc = None
+
+
+  def acquire(self):
+    """Try to take the shell for a command; False if it's busy."""
+    return self.lock.acquire(False)
+
+  def release(self):
+    self.lock.release()
+
+
+  def run(self, command, stdout, stderr, echo=False):
+    """Run COMMAND, writing its output to the STDOUT and STDERR captures (and
+    to our own stdout and stderr, if ECHO is set), and return its exit code."""
+    if self.proc is None or self.proc.poll() is not None:
+      self.start()
+
+    try:
+      self.proc.stdin.write(frame(command))
+      self.proc.stdin.flush()
+    except IOError:
+      return self.died()
+
+    outputs = {
+      self.proc.stdout.fileno(): (stdout, echo and sys.stdout),
+      self.proc.stderr.fileno(): (stderr, echo and sys.stderr),
+    }
+
+    poller = procio.Poller()
+    for fd in outputs.keys() + [self.status_fd]:
+      poller.register(fd)
+
+    status = ''
+    while not status.endswith('\n'):
+      for fd in poller.ready():
+        data = self.read(fd)
+        if data == '':
+          # The shell has gone
+          return self.died()
+        if fd == self.status_fd:
+          status += data
+        elif data:
+          self.write(outputs[fd], data)
+
+    # The command has finished, so the rest of its output is in the pipes
+    for (fd, output) in outputs.items():
+      while True:
+        data = self.read(fd)
+        if not data:
+          break
+        self.write(output, data)
+
+    return int(status)
+
+  def read(self, fd):
+    """Read what's available from FD: '' at EOF, None if there's nothing."""
+    try:
+      return os.read(fd, procio.CHUNK_SIZE)
+    except OSError, e:
+      if e.errno in (errno.EAGAIN, errno.EINTR):
+        return None
+      raise
+
+  def write(self, output, data):
+    (capture, echo_target) = output
+    capture.write(data)
+    if echo_target:
+      echo_target.write(data)
+      echo_target.flush()
+
+  def died(self):
+    """The shell has exited, perhaps because it was interrupted. Report the
+    command as failed, and start a new shell next time."""
+    self.proc.wait()
+    code = self.proc.returncode
+    self.close()
+    return code or -1
@@ -12,3 +12,9 @@ class UserError(Exception):
 class CommandError(Exception):
   def __init__(self, proc):
     self.proc = proc
+
+class TaskFailed(Exception):
+  """With -k, raised by a task which kept going after a failure. The failure
+  itself has been recorded by then."""
+  def __init__(self, name):
+    self.name = name
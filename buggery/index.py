@@ -0,0 +1,114 @@
+"""Parsing only the tasks a run needs, with `bugger --indexed`.
+
+A run only uses startup, the task it was asked for, shutdown, and whatever
+those call. Tasks start with a flush-left header (`name:` or `name(...):`),
+perhaps with flush-left annotations before it, so a quick scan of the lines
+finds where each one is. We then parse the task we start from, find the tasks
+it calls, parse those, and so on, and check only the tasks we've parsed.
+
+If anything goes wrong, such as a file the scan is confused by, the whole file
+is parsed as usual, which reports any real errors properly.
+"""
+
+import re
+import hashlib
+
+from lcdict import lcdict
+from buggery import Parser, Buggery
+from exceptions import UserError
+
+
+class Entry(object):
+  """Where a task's text is: from START up to END in the file, starting on
+  line LINENO. HEADER is the task's header line, for help."""
+
+  def __init__(self, name, start, lineno, header):
+    self.name = name
+    self.start = start
+    self.end = None
+    self.lineno = lineno
+    self.header = header
+
+
+class Index(object):
+
+  header_re = re.compile(r'(' + Parser.ID_syntax + r')\s*[:(]')
+
+  def __init__(self, input):
+    self.input = input
+    self.entries = lcdict()
+    self.order = []
+
+    annotations = None # the start of annotations waiting for their task
+    offset = 0
+    for (i, line) in enumerate(input.splitlines(True)):
+      if line.startswith('@'):
+        if annotations is None:
+          annotations = (offset, i + 1)
+      else:
+        m = self.header_re.match(line)
+        if m:
+          (start, lineno) = annotations or (offset, i + 1)
+          self.add(Entry(m.group(1), start, lineno, line.split('#')[0].strip()))
+          annotations = None
+      offset += len(line)
+
+    # Each task runs up to the start of the next one
+    for (entry, next) in zip(self.order, self.order[1:] + [None]):
+      entry.end = next.start if next else len(input)
+
+
+  def add(self, entry):
+    if entry.name in self.entries:
+      raise UserError("Duplicate task: %s" % entry.name, None)
+    self.entries[entry.name] = entry
+    self.order.append(entry)
+
+
+  def help_string(self):
+    result = "Available tasks:\n\n"
+
+    for entry in self.order:
+      result += "\t %s\n" % entry.header.rstrip(':')
+
+    return result
+
+
+  def load(self, names, filename=None):
+    """Parse the tasks in NAMES which exist, and every task they call, and
+    return them as a checked Buggery object. The functions of FILENAME's
+    sidecar module are tasks too."""
+    todo = [name for name in names if name in self.entries]
+    seen = set()
+    tasks = []
+    digests = {}
+
+    while todo:
+      entry = self.entries[todo.pop()]
+      if entry.name.lower() in seen:
+        continue
+      seen.add(entry.name.lower())
+
+      text = self.input[entry.start:entry.end]
+      for task in Parser().parse_tasks(text, entry.lineno):
+        tasks.append(task)
+        digests[task.name.lower()] = hashlib.sha1(text).hexdigest()
+        # Unknown tasks are left for the checker to complain about
+        todo.extend([name for name in task.callees() if name in self.entries])
+
+    buggery = Buggery(tasks)
+    buggery.source_digests = digests
+    if filename:
+      buggery.load_sidecar(filename)
+    buggery.check()
+    return buggery
+
+
+def load(filename, names):
+  """Return the checked Buggery object for the tasks NAMES in FILENAME, and
+  the tasks they call."""
+  input = file(filename).read()
+  try:
+    return Index(input).load(names, filename)
+  except UserError:
+    return Parser().parse(input, filename=filename)
@@ -0,0 +1,303 @@
+"""Running branches of a buggery task concurrently.
+
+A parallel group (`{a, b, c}`) runs each branch on a small pool of threads.
+However groups nest, at most `-j` branches run at once across the whole run:
+a branch holds one of the run's job slots while it runs, and lends it out
+while it waits for a group inside it. Each branch gets its own stack, starting from the frame of the task which
+contains the group. Output is kept in order: the first branch writes straight
+through, and the output of every other branch is buffered until all the
+branches before it have finished. If a branch fails, branches which haven't
+started are skipped, running commands are killed, and the first error is
+re-raised once everything has stopped.
+
+The subtasks of a @dataflow task run the same way, except that a subtask only
+starts once the subtasks it depends on have finished.
+"""
+
+import os
+import sys
+import Queue
+import signal
+import threading
+import multiprocessing
+
+
+class Cancelled(Exception):
+  """Raised in a branch whose group has been cancelled."""
+  pass
+
+
+def default_jobs():
+  try:
+    return multiprocessing.cpu_count()
+  except NotImplementedError:
+    return 1
+
+
+class Group(object):
+  """The running branches of one parallel group. Tracks the processes they
+  start, so that they can be killed if the group is cancelled. Each leads a
+  process group of its own, so that whatever it starts is killed too. Groups nest,
+  and cancelling a group cancels everything inside it."""
+
+  def __init__(self, parent):
+    self.parent = parent
+    self.lock = threading.Lock()
+    self.procs = set()
+    self.children = []
+    self.cancelled = False
+    if parent:
+      with parent.lock:
+        parent.children.append(self)
+
+  def is_cancelled(self):
+    return self.cancelled or (self.parent is not None and self.parent.is_cancelled())
+
+  def cancel(self):
+    with self.lock:
+      self.cancelled = True
+      procs = list(self.procs)
+      children = list(self.children)
+
+    for proc in procs:
+      kill(proc)
+
+    for child in children:
+      child.cancel()
+
+  def start(self, proc):
+    with self.lock:
+      self.procs.add(proc)
+    # We might have been cancelled while the process was starting
+    if self.is_cancelled():
+      kill(proc)
+
+  def finish(self, proc):
+    with self.lock:
+      self.procs.discard(proc)
+
+
+class Slots(object):
+  """The branches a run may have running at once, shared by all its groups."""
+
+  def __init__(self, jobs):
+    self.semaphore = threading.Semaphore(jobs)
+    self.local = threading.local()
+
+  def acquire(self):
+    self.semaphore.acquire()
+    self.local.held = True
+
+  def release(self):
+    self.local.held = False
+    self.semaphore.release()
+
+  def held(self):
+    """Whether the current thread is running a branch."""
+    return getattr(self.local, 'held', False)
+
+
+_slots_lock = threading.Lock()
+
+def job_slots(buggery, jobs):
+  with _slots_lock:
+    if buggery.job_slots is None:
+      buggery.job_slots = Slots(jobs)
+    return buggery.job_slots
+
+
+def kill(proc):
+  try:
+    os.killpg(proc.pid, signal.SIGKILL)
+  except OSError:
+    # Its group has gone, or it never had one
+    try:
+      proc.kill()
+    except OSError:
+      pass # already finished
+
+
+
+##############################
+# Ordered output
+##############################
+
+# The buffer which the current thread's output goes to, or None to write it out
+# directly.
+_output = threading.local()
+
+class OrderedOutput(object):
+  """Replaces sys.stdout and sys.stderr while branches run, and sends each
+  thread's output to its branch's buffer. A buffer is a list of (stream, data)
+  pairs, so interleaved stdout and stderr come back out in the same order."""
+
+  def __init__(self, stream):
+    self.stream = stream
+
+  def write(self, data):
+    buffer = getattr(_output, 'buffer', None)
+    if buffer is None:
+      self.stream.write(data)
+    else:
+      buffer.append((self, data))
+
+  def flush(self):
+    if getattr(_output, 'buffer', None) is None:
+      self.stream.flush()
+
+  def __getattr__(self, name):
+    return getattr(self.stream, name)
+
+
+_install_lock = threading.Lock()
+
+def install_ordered_output():
+  with _install_lock:
+    if not isinstance(sys.stdout, OrderedOutput):
+      sys.stdout = OrderedOutput(sys.stdout)
+    if not isinstance(sys.stderr, OrderedOutput):
+      sys.stderr = OrderedOutput(sys.stderr)
+
+
+def replay(buffer):
+  """Write a finished branch's output, as though the current thread wrote it."""
+  for (stream, data) in buffer:
+    stream.write(data)
+  sys.stdout.flush()
+  sys.stderr.flush()
+
+
+
+##############################
+# Running branches
+##############################
+
+def run_branches(buggery, branches):
+  """Run each of BRANCHES, a list of functions taking the Buggery object, using
+  at most `buggery.options.jobs` threads."""
+  run_graph(buggery, branches, [[] for branch in branches])
+
+
+def run_graph(buggery, branches, deps):
+  """Run BRANCHES as run_branches does, but only start each once the branches
+  it depends on have finished. DEPS[i] lists the indices of the branches which
+  branch i depends on, which all come before it."""
+  max_jobs = buggery.options.jobs or default_jobs()
+  jobs = min(max_jobs, len(branches))
+  if jobs <= 1:
+    for branch in branches:
+      branch(buggery)
+    return
+
+  install_ordered_output()
+
+  frame = buggery.stack[-1]
+  parent_group = buggery.group
+  profiler = buggery.profiler
+  profile_node = profiler and profiler.current()
+  group = Group(parent_group)
+  slots = job_slots(buggery, max_jobs)
+
+  count = len(branches)
+  done = [threading.Event() for i in range(count)]
+  errors = []
+  # The first branch writes wherever our own output goes
+  buffers = [getattr(_output, 'buffer', None)] + [[] for i in range(count - 1)]
+
+  # Branches go on the queue when everything they depend on has finished, and
+  # a None for each thread once everything has.
+  waiting = [len(d) for d in deps]
+  dependents = [[] for i in range(count)]
+  for (i, d) in enumerate(deps):
+    for j in d:
+      dependents[j].append(i)
+  finished = [0]
+
+  queue = Queue.Queue()
+  for i in range(count):
+    if not waiting[i]:
+      queue.put(i)
+
+  def finish(i):
+    with group.lock:
+      finished[0] += 1
+      ready = []
+      for j in dependents[i]:
+        waiting[j] -= 1
+        if not waiting[j]:
+          ready.append(j)
+      last = finished[0] == count
+    for j in ready:
+      queue.put(j)
+    if last:
+      for thread in range(jobs):
+        queue.put(None)
+
+  def worker():
+    buggery.stack = [frame]
+    buggery.group = group
+    if profiler:
+      profiler.set_current(profile_node)
+    while True:
+      i = queue.get()
+      if i is None:
+        return
+
+      _output.buffer = buffers[i]
+      try:
+        if group.is_cancelled():
+          raise Cancelled()
+        slots.acquire()
+        try:
+          branches[i](buggery)
+        finally:
+          slots.release()
+      except Cancelled:
+        pass
+      except BaseException:
+        # Only the first failure counts; everything after it is likely to be
+        # fallout from cancelling.
+        with group.lock:
+          if not group.cancelled:
+            errors.append(sys.exc_info())
+        group.cancel()
+      finally:
+        _output.buffer = None
+        done[i].set()
+        # Branches after a failure still finish, by being skipped
+        finish(i)
+
+  # If we're a branch ourselves, let our branches have our slot while we wait
+  lent = slots.held()
+  if lent:
+    slots.release()
+  try:
+    threads = [threading.Thread(target=worker) for i in range(jobs)]
+    for thread in threads:
+      thread.setDaemon(True)
+      thread.start()
+
+    try:
+      for i in range(count):
+        # Wait in steps, so that ^C gets through: the branches' commands are
+        # in process groups of their own, so the terminal doesn't stop them
+        while not done[i].wait(0.1):
+          pass
+        if i > 0:
+          replay(buffers[i])
+    except KeyboardInterrupt:
+      group.cancel()
+      raise
+
+    for thread in threads:
+      thread.join()
+  finally:
+    if lent:
+      slots.acquire()
+
+  if errors:
+    (type, value, traceback) = errors[0]
+    raise type, value, traceback
+
+  if parent_group and parent_group.is_cancelled():
+    raise Cancelled()
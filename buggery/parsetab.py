@@ -0,0 +1,67 @@
+
+# parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = "ANNOTATION COMMAND ID INDENT STRING\n      file : task_list\n    \n      task_list : task_list task\n                | empty\n    \n      empty :\n    \n      task : annotation_list ID ':' subtask_lines\n           | annotation_list ID '(' param_list ')' ':' subtask_lines\n    \n      annotation_list : annotation_list annotation\n                      | empty\n    \n      annotation : ANNOTATION\n                 | ANNOTATION '(' arg_list ')'\n    \n      subtask_lines : subtask_lines subtask_line\n                    | empty\n    \n      subtask_line : INDENT subtask\n                   | INDENT ANNOTATION subtask\n    \n      subtask : lvalue expr\n              | call_list\n              | command\n              | '{' call_list '}'\n    \n      expr : command\n           | call\n           | STRING\n    \n    command : '$' COMMAND\n    \n      lvalue : ID '='\n    \n      call_list : call ',' call_list\n                | call\n    \n      call : ID '(' arg_list ')'\n           | ID\n    \n      arg_list : arg ',' arg_list\n               | arg\n    \n      arg : variable\n          | STRING\n    \n      param_list : param ',' param_list\n                 | param\n    \n      param : ID\n            | ID '=' default_param\n    \n      default_param : arg\n    \n      variable : ID\n    "
+    
+_lr_action_items = {'INDENT':([12,21,22,28,31,36,38,39,40,42,44,45,47,48,49,50,51,55,56,58,59,],[-4,29,-12,-11,-4,-25,-27,-13,-17,-16,29,-22,-21,-20,-15,-19,-27,-14,-24,-18,-26,]),'STRING':([10,23,27,37,52,53,],[13,13,13,47,13,-23,]),')':([13,14,15,16,17,18,19,20,30,32,33,34,57,],[-31,-37,-29,-30,24,25,-33,-34,-28,-32,-35,-36,59,]),'(':([8,9,38,51,],[10,11,52,52,]),',':([13,14,15,16,19,20,33,34,36,38,51,59,],[-31,-37,23,-30,26,-34,-35,-36,46,-27,-27,-26,]),'ID':([0,1,3,4,5,6,7,8,10,11,12,21,22,23,24,26,27,28,29,31,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,55,56,58,59,],[-4,-3,-4,9,-2,-8,-7,-9,14,20,-4,-5,-12,14,-10,20,14,-11,38,-4,-25,51,-27,-13,-17,51,-16,38,-6,-22,51,-21,-20,-15,-19,-27,14,-23,-14,-24,-18,-26,]),'COMMAND':([35,],[45,]),'$':([29,37,43,53,],[35,35,35,-23,]),'}':([36,51,54,56,59,],[-25,-27,58,-24,-26,]),'{':([29,43,],[41,41,]),':':([9,25,],[12,31,]),'=':([20,38,],[27,53,]),'ANNOTATION':([0,1,3,4,5,6,7,8,12,21,22,24,28,29,31,36,38,39,40,42,44,45,47,48,49,50,51,55,56,58,59,],[-4,-3,-4,8,-2,-8,-7,-9,-4,-5,-12,-10,-11,43,-4,-25,-27,-13,-17,-16,-6,-22,-21,-20,-15,-19,-27,-14,-24,-18,-26,]),'$end':([0,1,2,3,5,12,21,22,28,31,36,38,39,40,42,44,45,47,48,49,50,51,55,56,58,59,],[-4,-3,0,-1,-2,-4,-5,-12,-11,-4,-25,-27,-13,-17,-16,-6,-22,-21,-20,-15,-19,-27,-14,-24,-18,-26,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'default_param':([27,],[33,]),'annotation_list':([3,],[4,]),'task':([3,],[5,]),'subtask_lines':([12,31,],[21,44,]),'param_list':([11,26,],[18,32,]),'lvalue':([29,43,],[37,37,]),'arg':([10,23,27,52,],[15,15,34,15,]),'subtask':([29,43,],[39,55,]),'param':([11,26,],[19,19,]),'expr':([37,],[49,]),'subtask_line':([21,44,],[28,28,]),'call':([29,37,41,43,46,],[36,48,36,36,36,]),'file':([0,],[2,]),'task_list':([0,],[3,]),'variable':([10,23,27,52,],[16,16,16,16,]),'command':([29,37,43,],[40,50,40,]),'call_list':([29,41,43,46,],[42,54,42,56,]),'annotation':([4,],[7,]),'empty':([0,3,12,31,],[1,6,22,22,]),'arg_list':([10,23,52,],[17,30,57,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> file","S'",1,None,None,None),
+  ('file -> task_list','file',1,'p_file','buggery.py',228),
+  ('task_list -> task_list task','task_list',2,'p_task_list','buggery.py',243),
+  ('task_list -> empty','task_list',1,'p_task_list','buggery.py',244),
+  ('empty -> <empty>','empty',0,'p_empty','buggery.py',254),
+  ('task -> annotation_list ID : subtask_lines','task',4,'p_task','buggery.py',261),
+  ('task -> annotation_list ID ( param_list ) : subtask_lines','task',7,'p_task','buggery.py',262),
+  ('annotation_list -> annotation_list annotation','annotation_list',2,'p_annotation_list','buggery.py',283),
+  ('annotation_list -> empty','annotation_list',1,'p_annotation_list','buggery.py',284),
+  ('annotation -> ANNOTATION','annotation',1,'p_annotation','buggery.py',294),
+  ('annotation -> ANNOTATION ( arg_list )','annotation',4,'p_annotation','buggery.py',295),
+  ('subtask_lines -> subtask_lines subtask_line','subtask_lines',2,'p_subtask_lines','buggery.py',307),
+  ('subtask_lines -> empty','subtask_lines',1,'p_subtask_lines','buggery.py',308),
+  ('subtask_line -> INDENT subtask','subtask_line',2,'p_subtask_line','buggery.py',320),
+  ('subtask_line -> INDENT ANNOTATION subtask','subtask_line',3,'p_subtask_line','buggery.py',321),
+  ('subtask -> lvalue expr','subtask',2,'p_subtask','buggery.py',337),
+  ('subtask -> call_list','subtask',1,'p_subtask','buggery.py',338),
+  ('subtask -> command','subtask',1,'p_subtask','buggery.py',339),
+  ('subtask -> { call_list }','subtask',3,'p_subtask','buggery.py',340),
+  ('expr -> command','expr',1,'p_expr','buggery.py',358),
+  ('expr -> call','expr',1,'p_expr','buggery.py',359),
+  ('expr -> STRING','expr',1,'p_expr','buggery.py',360),
+  ('command -> $ COMMAND','command',2,'p_command','buggery.py',368),
+  ('lvalue -> ID =','lvalue',2,'p_lvalue','buggery.py',414),
+  ('call_list -> call , call_list','call_list',3,'p_call_list','buggery.py',421),
+  ('call_list -> call','call_list',1,'p_call_list','buggery.py',422),
+  ('call -> ID ( arg_list )','call',4,'p_call','buggery.py',432),
+  ('call -> ID','call',1,'p_call','buggery.py',433),
+  ('arg_list -> arg , arg_list','arg_list',3,'p_arg_list','buggery.py',446),
+  ('arg_list -> arg','arg_list',1,'p_arg_list','buggery.py',447),
+  ('arg -> variable','arg',1,'p_arg','buggery.py',457),
+  ('arg -> STRING','arg',1,'p_arg','buggery.py',458),
+  ('param_list -> param , param_list','param_list',3,'p_param_list','buggery.py',465),
+  ('param_list -> param','param_list',1,'p_param_list','buggery.py',466),
+  ('param -> ID','param',1,'p_param','buggery.py',476),
+  ('param -> ID = default_param','param',3,'p_param','buggery.py',477),
+  ('default_param -> arg','default_param',1,'p_default_param','buggery.py',490),
+  ('variable -> ID','variable',1,'p_variable','buggery.py',497),
+]
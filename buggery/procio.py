@@ -0,0 +1,302 @@
+"""Talking to subprocesses.
+
+communicate() runs a single poll() loop over a process's stdin, stdout and
+stderr. Output is read in large chunks as soon as it is available, stdin is
+written only when the pipe can take more (so large inputs can't deadlock
+against a process which is busy writing), and we return as soon as the
+process has closed its output and exited.
+"""
+
+import os
+import re
+import sys
+import errno
+import fcntl
+import shlex
+import select
+import shutil
+import signal
+import subprocess
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Capture(object):
+  """Collects the output of one stream of a process.
+
+  Output is kept as a list of chunks, and only joined when it is asked for. If
+  LIMIT is set, then once more than LIMIT bytes have been written, everything
+  is moved to a temporary file and later output is appended there, so
+  commands with huge output don't have to be held in memory."""
+
+  def __init__(self, limit=None):
+    self.chunks = []
+    self.size = 0
+    self.limit = limit
+    self.spill = None
+
+  def write(self, data):
+    self.size += len(data)
+    if self.spill:
+      self.spill.write(data)
+      return
+
+    self.chunks.append(data)
+    if self.limit and self.size > self.limit:
+      self.spill = tempfile.NamedTemporaryFile(prefix='bugger-')
+      for chunk in self.chunks:
+        self.spill.write(chunk)
+      self.chunks = []
+
+  def getvalue(self):
+    if self.spill:
+      self.spill.flush()
+      self.spill.seek(0)
+      return self.spill.read()
+
+    # Keep the joined string, so asking again is free and we don't hold both
+    if len(self.chunks) > 1:
+      self.chunks = [''.join(self.chunks)]
+    return self.chunks[0] if self.chunks else ''
+
+  def open(self):
+    """A file to read the output from, from its start, if it has spilled, or
+    None if it's in memory. Each has its own offset, so it can be given to a
+    process as its stdin while others read the output too."""
+    if not self.spill:
+      return None
+    self.spill.flush()
+    return open(self.spill.name, 'rb')
+
+  def write_to(self, f):
+    """Write the output to the file F, without reading spilled output into
+    memory all at once."""
+    source = self.open()
+    if source is None:
+      f.write(self.getvalue())
+      return
+    try:
+      shutil.copyfileobj(source, f, CHUNK_SIZE)
+    finally:
+      source.close()
+
+
+class Poller(object):
+  """The subset of select.poll() we need, falling back to select.select() on
+  platforms without poll()."""
+
+  def __init__(self):
+    self.readers = set()
+    self.writers = set()
+    self.poll = select.poll() if hasattr(select, 'poll') else None
+
+  def register(self, fd, writing=False):
+    (self.writers if writing else self.readers).add(fd)
+    if self.poll:
+      self.poll.register(fd, select.POLLOUT if writing else select.POLLIN)
+
+  def unregister(self, fd):
+    self.readers.discard(fd)
+    self.writers.discard(fd)
+    if self.poll:
+      self.poll.unregister(fd)
+
+  def __len__(self):
+    return len(self.readers) + len(self.writers)
+
+  def ready(self):
+    """Return the fds which can be read or written without blocking."""
+    while True:
+      try:
+        if self.poll:
+          return [fd for (fd, event) in self.poll.poll()]
+
+        (r, w, x) = select.select(list(self.readers), list(self.writers), [])
+        return r + w
+      except select.error, e:
+        if e.args[0] != errno.EINTR:
+          raise
+
+
+def set_nonblocking(fd):
+  flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+  fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+# Characters which mean a command needs the shell: pipes, redirects, globs,
+# expansions, quoting with backslashes, comments and so on.
+SHELL_CHARS_RE = re.compile(r'[|&;<>()$`\\*?\[\]{}~#!\n]')
+
+# Commands the shell runs itself, or which behave differently when run directly
+# (dash's echo and /bin/echo disagree about options, /bin/pwd prints the
+# physical directory rather than $PWD, and printf and kill differ in the
+# escapes, options and output they support).
+SHELL_WORDS = frozenset([
+  '.', ':', 'alias', 'bg', 'break', 'case', 'cd', 'command', 'continue', 'do',
+  'done', 'echo', 'elif', 'else', 'esac', 'eval', 'exec', 'exit', 'export',
+  'fg', 'fi', 'for', 'function', 'getopts', 'hash', 'if', 'jobs', 'kill',
+  'local', 'printf', 'pwd', 'read', 'readonly', 'return', 'set', 'shift',
+  'source', 'then', 'time', 'times', 'trap', 'type', 'ulimit', 'umask',
+  'unalias', 'unset', 'until', 'wait', 'while',
+])
+
+
+def needs_shell(text):
+  return SHELL_CHARS_RE.search(text) is not None
+
+
+def direct_argv(command):
+  """The arguments to run COMMAND with directly, or None if it needs the
+  shell."""
+  if needs_shell(command):
+    return None
+
+  try:
+    argv = shlex.split(command)
+  except ValueError: # unbalanced quotes
+    return None
+
+  if not argv or argv[0] in SHELL_WORDS or '=' in argv[0]:
+    return None
+  return argv
+
+
+_programs = {}
+
+def find_program(name):
+  """The path of the program NAME, searching $PATH the way the shell does, or
+  None if there isn't one. Like the shell, we remember where we found it, which
+  saves trying to exec it in each directory of $PATH every time."""
+  if '/' in name:
+    return name
+
+  path = os.environ.get('PATH', os.defpath)
+  key = (name, path)
+  if key not in _programs:
+    _programs[key] = None
+    for dir in path.split(os.pathsep):
+      filename = os.path.join(dir or '.', name)
+      if os.path.isfile(filename) and os.access(filename, os.X_OK):
+        _programs[key] = filename
+        break
+  return _programs[key]
+
+
+def popen(command, simple=False, own_group=False, **kwargs):
+  """Start COMMAND, like subprocess.Popen. Commands which don't use anything
+  from the shell are run directly, saving starting /bin/sh. SIMPLE says the
+  literal text of the command doesn't, which the parser works out once; we
+  still check the command once it's been interpolated. If the program can't
+  be run, the shell runs it instead, so it reports the error as usual.
+
+  If OWN_GROUP is set, the process leads a process group of its own, so that
+  killing the group kills whatever the shell started too."""
+  if own_group:
+    preexec_fn = kwargs.get('preexec_fn')
+    def setpgrp():
+      os.setpgrp()
+      if preexec_fn:
+        preexec_fn()
+    kwargs['preexec_fn'] = setpgrp
+
+  if simple:
+    argv = direct_argv(command)
+    program = argv and find_program(argv[0])
+    if program:
+      try:
+        return subprocess.Popen(argv, executable=program, **kwargs)
+      except OSError:
+        pass
+
+  return subprocess.Popen(command, shell=True, **kwargs)
+
+
+def restore_sigpipe():
+  """Python ignores SIGPIPE, and its children inherit that. Restore the
+  default in a child, so that a process writing into a closed pipe is killed
+  rather than seeing write errors."""
+  signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def communicate(proc, input, stdout, stderr, echo=False):
+  """Write INPUT (which may be None) to PROC's stdin, and write everything it
+  prints to the STDOUT and STDERR captures. If ECHO is set, output is also
+  copied to our own stdout and stderr as it arrives. Returns the exit code."""
+  outputs = [(proc.stdout, stdout, sys.stdout), (proc.stderr, stderr, sys.stderr)]
+  pump(proc.stdin, input, [(pipe, capture, echo_target if echo else None) for (pipe, capture, echo_target) in outputs])
+  return wait(proc)
+
+
+def wait(proc):
+  """Wait for PROC to exit, and return its exit code. Its resource usage (as
+  from os.wait4) is kept in proc.rusage, or None if it isn't available."""
+  proc.rusage = None
+  if proc.returncode is None:
+    while True:
+      try:
+        (pid, status, proc.rusage) = os.wait4(proc.pid, 0)
+        proc._handle_exitstatus(status)
+        break
+      except OSError, e:
+        if e.errno == errno.EINTR:
+          continue
+        if e.errno != errno.ECHILD:
+          raise
+        # Someone else reaped it
+        break
+  return proc.wait()
+
+
+def pump(stdin, input, outputs):
+  """Write INPUT (which may be None) to the STDIN pipe, while reading each of
+  OUTPUTS, a list of (pipe, capture, echo_target) triples, into its capture
+  until it is closed. ECHO_TARGET may be None, and a pipe may be None if it
+  isn't being read. Several captures may be the same object."""
+  poller = Poller()
+  targets = {}
+
+  for (pipe, capture, echo_target) in outputs:
+    if pipe:
+      targets[pipe.fileno()] = (capture, echo_target)
+      poller.register(pipe.fileno())
+
+  stdin_fd = None
+  offset = 0
+  if stdin:
+    if input:
+      stdin_fd = stdin.fileno()
+      set_nonblocking(stdin_fd)
+      poller.register(stdin_fd, writing=True)
+    else:
+      stdin.close()
+
+  while len(poller):
+    for fd in poller.ready():
+      if fd == stdin_fd:
+        try:
+          offset += os.write(fd, buffer(input, offset, CHUNK_SIZE))
+        except OSError, e:
+          if e.errno == errno.EAGAIN:
+            continue
+          if e.errno != errno.EPIPE:
+            raise
+          # The process doesn't want the rest of its input
+          offset = len(input)
+
+        if offset >= len(input):
+          poller.unregister(fd)
+          stdin.close()
+          stdin_fd = None
+
+      else:
+        data = os.read(fd, CHUNK_SIZE)
+        if data == '':
+          poller.unregister(fd)
+          continue
+
+        (capture, echo_target) = targets[fd]
+        capture.write(data)
+        if echo_target:
+          echo_target.write(data)
+          echo_target.flush()
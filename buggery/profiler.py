@@ -0,0 +1,184 @@
+"""Finding out where the time goes, with `bugger --profile`.
+
+Every task call and every command is timed, and recorded in a call tree: a
+node for each task or command site (its line and column), under the node of
+the task which called it. Each node counts its calls, their wall time, the
+CPU time of the processes they ran, and the bytes those processes wrote to
+stdout and stderr. Inclusive times count everything below a node; exclusive
+times leave out the node's children.
+
+The tree is printed when the script finishes, followed by the totals for each
+task and command site. With `--profile-trace FILE`, every call is also written
+to FILE in Chrome's trace event format, for chrome://tracing or Perfetto.
+"""
+
+import os
+import json
+import time
+import threading
+
+from exceptions import CommandError
+
+
+class Node(object):
+  """The calls to one task or command site, from one place in the call tree."""
+
+  def __init__(self, kind, name, site):
+    self.kind = kind # 'task' or 'command'
+    self.name = name
+    self.site = site # (line, column) for commands, otherwise None
+    self.children = {}
+    self.order = []
+    self.calls = 0
+    self.wall = 0.0
+    self.cpu = 0.0
+    self.stdout = 0
+    self.stderr = 0
+
+  def key(self):
+    return (self.kind, self.name, self.site)
+
+  def child(self, kind, name, site):
+    key = (kind, name, site)
+    if key not in self.children:
+      self.children[key] = Node(kind, name, site)
+      self.order.append(self.children[key])
+    return self.children[key]
+
+  def exclusive(self):
+    # Children in parallel groups may add up to more than their parent
+    return max(0.0, self.wall - sum([c.wall for c in self.order]))
+
+  def inclusive_cpu(self):
+    return self.cpu + sum([c.inclusive_cpu() for c in self.order])
+
+  def label(self):
+    if self.kind == 'command':
+      return "$ %s (%d:%d)" % (shorten(self.name), self.site[0], self.site[1])
+    return self.name
+
+
+def shorten(string, length=50):
+  string = string.replace('\n', ' ')
+  return string if len(string) <= length else string[0:length - 3] + '...'
+
+
+def child_cpu(result):
+  """The user and system time of the processes behind RESULT, a ProcData."""
+  return sum([r.ru_utime + r.ru_stime for r in (result.rusages or []) if r is not None])
+
+
+class Profiler(object):
+
+  def __init__(self, trace=False):
+    self.root = Node('run', None, None)
+    self.lock = threading.Lock()
+    self._local = threading.local()
+    self.start = time.time()
+    self.events = [] if trace else None
+
+
+  def current(self):
+    """The node whose calls are being made on this thread."""
+    return getattr(self._local, 'node', self.root)
+
+  def set_current(self, node):
+    """Make calls on this thread children of NODE, such as when a parallel
+    branch starts."""
+    self._local.node = node
+
+
+  def call(self, kind, name, site, func):
+    """Call FUNC, recording the call as a child of the current node. For
+    commands, FUNC returns a ProcData, or raises a CommandError holding one."""
+    parent = self.current()
+    with self.lock:
+      node = parent.child(kind, name, site)
+    self.set_current(node)
+
+    result = None
+    start = time.time()
+    try:
+      try:
+        result = func()
+        return result
+      except CommandError, e:
+        result = e.proc
+        raise
+    finally:
+      wall = time.time() - start
+      self.set_current(parent)
+      self.record(node, start, wall, result if kind == 'command' else None)
+
+
+  def record(self, node, start, wall, result):
+    with self.lock:
+      node.calls += 1
+      node.wall += wall
+      if result is not None:
+        node.cpu += child_cpu(result)
+        node.stdout += result.stdout_bytes
+        node.stderr += result.stderr_bytes
+
+      if self.events is not None:
+        args = {}
+        if node.site:
+          args['site'] = "%d:%d" % node.site
+        self.events.append({
+          'name': node.label(),
+          'cat': node.kind,
+          'ph': 'X',
+          'ts': int((start - self.start) * 1e6),
+          'dur': int(wall * 1e6),
+          'pid': os.getpid(),
+          'tid': threading.current_thread().ident,
+          'args': args,
+        })
+
+
+  def totals(self):
+    """Sum the nodes for each task and command site over the whole tree, as a
+    list of (key, calls, inclusive, exclusive, cpu, stdout, stderr). Recursive
+    tasks count their inclusive time once per level."""
+    totals = {}
+    labels = {}
+    todo = list(self.root.order)
+    while todo:
+      node = todo.pop()
+      todo.extend(node.order)
+      labels[node.key()] = node.label()
+      t = totals.setdefault(node.key(), [0, 0.0, 0.0, 0.0, 0, 0])
+      for (i, value) in enumerate([node.calls, node.wall, node.exclusive(), node.inclusive_cpu(), node.stdout, node.stderr]):
+        t[i] += value
+
+    return sorted([(labels[k],) + tuple(v) for (k, v) in totals.items()], key=lambda t: -t[3])
+
+
+  def report(self):
+    lines = []
+    header = "%9s %9s %9s %7s %10s %10s  %s"
+    row = "%9.3f %9.3f %9.3f %7d %10d %10d  %s"
+    lines.append("Profile (seconds):")
+    lines.append(header % ("incl", "excl", "cpu", "calls", "stdout", "stderr", "call tree"))
+
+    def walk(node, depth):
+      for child in sorted(node.order, key=lambda c: -c.wall):
+        lines.append(row % (child.wall, child.exclusive(), child.inclusive_cpu(), child.calls,
+                            child.stdout, child.stderr, "  " * depth + child.label()))
+        walk(child, depth + 1)
+    walk(self.root, 0)
+
+    lines.append("")
+    lines.append(header % ("incl", "excl", "cpu", "calls", "stdout", "stderr", "task or command"))
+    for (label, calls, wall, exclusive, cpu, stdout, stderr) in self.totals():
+      lines.append(row % (wall, exclusive, cpu, calls, stdout, stderr, label))
+
+    return "\n".join(lines)
+
+
+  def write_trace(self, filename):
+    f = file(filename, 'w')
+    try:
+      json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+    finally:
+      f.close()
@@ -0,0 +1,94 @@
+"""Running scripts in the background, for programs which embed buggery.
+
+`Buggery.run_async(task, args)` starts the task on a thread of its own and
+returns a Run. Each run uses a copy of the script from `Buggery.spawn()`, with
+its own stacks and globals, so a long-lived program can load a script once and
+have any number of runs of it going at once. The runs' commands are processes,
+and their threads spend their time waiting on them, so runs are cheap.
+
+A Run can be waited for, or polled: `fileno()` is a file descriptor which
+becomes readable when the run has finished, for select(), poll() or an event
+loop's reader callbacks. Whatever the run prints is kept in the Run, rather
+than mixed with the output of other runs, and `cancel()` kills its commands.
+"""
+
+import os
+import sys
+import threading
+
+import parallel
+
+
+class Run(object):
+  """A run of the task TASKNAME, with startup and shutdown around it, using
+  BUGGERY, a Buggery object which no other run uses."""
+
+  def __init__(self, buggery, taskname, args):
+    self.buggery = buggery
+    self.taskname = taskname
+    self.group = parallel.Group(None)
+    self.buffer = [] # (stream, data) pairs, as for a parallel branch
+    self.value = None
+    self.error = None
+    self.finished = threading.Event()
+    (self.read_fd, self.write_fd) = os.pipe()
+
+    parallel.install_ordered_output()
+    self.thread = threading.Thread(target=self.run, args=(args,))
+    self.thread.setDaemon(True)
+    self.thread.start()
+
+  def run(self, args):
+    buggery = self.buggery
+    buggery.group = self.group
+    parallel._output.buffer = self.buffer
+    try:
+      if buggery.has_task("startup"):
+        buggery.run("startup", [])
+      self.value = buggery.run(self.taskname, args)
+      if buggery.has_task("shutdown"):
+        buggery.run("shutdown", [])
+    except BaseException:
+      self.error = sys.exc_info()
+    finally:
+      parallel._output.buffer = None
+      self.finished.set()
+      os.write(self.write_fd, 'x')
+
+
+  def fileno(self):
+    """A file descriptor which is readable once the run has finished."""
+    return self.read_fd
+
+  def done(self):
+    return self.finished.is_set()
+
+  def wait(self, timeout=None):
+    """Wait for the run to finish, for at most TIMEOUT seconds; return whether
+    it has."""
+    return self.finished.wait(timeout)
+
+  def result(self):
+    """Wait for the run, and return what the task returned, or raise what it
+    raised."""
+    self.wait()
+    if self.error:
+      (type, value, traceback) = self.error
+      raise type, value, traceback
+    return self.value
+
+  def output(self):
+    """What the run has printed so far."""
+    return "".join([data for (stream, data) in list(self.buffer)])
+
+  def cancel(self):
+    """Kill the run's commands, and any it starts from now on, so that it
+    fails soon."""
+    self.group.cancel()
+
+  def close(self):
+    """Release the run's file descriptors, once it has finished."""
+    # The thread writes to the pipe after finishing, so wait for it to exit
+    self.thread.join()
+    for fd in [self.read_fd, self.write_fd]:
+      os.close(fd)
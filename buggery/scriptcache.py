@@ -0,0 +1,154 @@
+"""An on-disk cache of parsed and checked buggery files.
+
+Building the lexer and parser, parsing a file and checking it only depends on
+the contents of the file and on the version of buggery, so we pickle the
+checked Buggery object and reuse it while neither has changed.
+
+Each buggery file has one cache entry, named after the SHA-1 of its absolute
+path. An entry is a pickled header followed by the pickled Buggery object. If
+the file's mtime and size match the header, we don't even read the file.
+Otherwise we hash its contents, and only reparse if the hash has changed.
+
+The header also holds the check keys of the tasks in the cached file (see
+buggery.Checker). When a file has changed, it has to be parsed again, but only
+the tasks which changed (or whose callees changed) are checked again.
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+import cPickle as pickle
+
+from buggery import Parser, VERSION, sidecar_filename
+
+# Bump this if the layout of a cache entry changes.
+FORMAT = 3
+
+
+def cache_dir():
+  if os.environ.get('BUGGERY_CACHE_DIR'):
+    return os.environ['BUGGERY_CACHE_DIR']
+
+  base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+  return os.path.join(base, 'buggery')
+
+
+def implementation_stamp():
+  """Identify this buggery, so that ASTs pickled by a different version (or a
+  locally modified one) are never reused."""
+  source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'buggery.py')
+  try:
+    st = os.stat(source)
+    return (FORMAT, VERSION, st.st_mtime, st.st_size)
+  except OSError:
+    return (FORMAT, VERSION)
+
+
+def sidecar_stamp(path):
+  """Identify the version of the script PATH's sidecar module, if it has one.
+  The script is checked against its functions, so a changed sidecar means
+  checking the script again."""
+  sidecar = sidecar_filename(path)
+  try:
+    st = os.stat(sidecar)
+    return (st.st_mtime, st.st_size)
+  except (OSError, TypeError):
+    return None
+
+
+def entry_filename(path):
+  return os.path.join(cache_dir(), hashlib.sha1(path).hexdigest() + '.pickle')
+
+
+def load(filename, use_cache=True):
+  """Return the checked Buggery object for FILENAME, parsing it only if it has
+  changed since it was last cached."""
+  if not use_cache:
+    return Parser().parse(file(filename).read(), filename=filename)
+
+  path = os.path.abspath(filename)
+  st = os.stat(path)
+  entry = entry_filename(path)
+  stamp = implementation_stamp()
+  sidecar = sidecar_stamp(path)
+
+  header, body = read_entry(entry)
+  if header and header['stamp'] != stamp:
+    header, body = None, None
+  # Cached scripts were checked against the sidecar's functions as they were
+  unchanged = header and header['sidecar'] == sidecar
+
+  # Fast path: the file hasn't been touched.
+  if unchanged and header['mtime'] == st.st_mtime and header['size'] == st.st_size:
+    bugger = body()
+    if bugger is not None:
+      bugger.load_sidecar(path)
+      return bugger
+
+  input = file(path).read()
+  digest = hashlib.sha1(input).hexdigest()
+
+  bugger = None
+  if unchanged and header['digest'] == digest:
+    bugger = body()
+    if bugger is not None:
+      bugger.load_sidecar(path)
+
+  if bugger is None:
+    verified = header['checked'] if unchanged else ()
+    bugger = Parser().parse(input, verified, filename=path)
+
+  write_entry(entry, stamp, st, sidecar, digest, bugger)
+  return bugger
+
+
+def read_entry(entry):
+  """Return the header of the cache entry, and a function to unpickle the rest
+  of it. The cache is just an optimization, so an unreadable entry is treated
+  as a missing one."""
+  try:
+    f = file(entry, 'rb')
+    header = pickle.load(f)
+  except Exception:
+    return None, None
+
+  def body():
+    try:
+      return pickle.load(f)
+    except Exception:
+      return None
+    finally:
+      f.close()
+
+  return header, body
+
+
+def write_entry(entry, stamp, st, sidecar, digest, bugger):
+  # A file modified again within the resolution of its mtime would look
+  # unchanged, so don't trust the mtime of very recently modified files.
+  mtime = st.st_mtime
+  if time.time() - mtime < 2:
+    mtime = None
+
+  header = {'stamp': stamp, 'mtime': mtime, 'size': st.st_size, 'sidecar': sidecar, 'digest': digest, 'checked': bugger.check_keys}
+
+  try:
+    dir = os.path.dirname(entry)
+    if not os.path.isdir(dir):
+      os.makedirs(dir)
+
+    # Write to a temporary file and rename it, so that concurrent invocations
+    # never see a partial entry.
+    (fd, tmpname) = tempfile.mkstemp(dir=dir, suffix='.tmp')
+    try:
+      f = os.fdopen(fd, 'wb')
+      pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+      pickle.dump(bugger, f, pickle.HIGHEST_PROTOCOL)
+      f.close()
+      os.rename(tmpname, entry)
+    except:
+      os.remove(tmpname)
+      raise
+  except Exception:
+    pass
@@ -0,0 +1,255 @@
+"""Keeping parsed scripts warm between runs, with `bugger --server`.
+
+Every run of bugger pays for starting Python, importing buggery, and loading
+its script. `bugger --server` listens on a Unix socket instead, and keeps the
+scripts it has loaded, by path and modification time. When BUGGER_SOCKET is
+set, bugger is a client of the server listening there: it connects, passes
+its stdin, stdout and stderr over the socket, and sends its arguments,
+working directory and environment.
+
+The server loads the script, then forks a child for the request. The child
+takes on the client's file descriptors, directory and environment, runs the
+command line as bugger would, and sends back the exit status, which the
+client exits with. The child starts a process group of its own, and the
+client passes on SIGINT and SIGTERM to it, so ^C works as usual.
+"""
+
+import os
+import sys
+import errno
+import signal
+import socket
+import struct
+import marshal
+import traceback
+import _multiprocessing
+
+# Clients load this module on its own, without the rest of buggery, so
+# scriptcache is only imported by the server.
+
+
+def socket_path():
+  if os.environ.get('BUGGER_SOCKET'):
+    return os.environ['BUGGER_SOCKET']
+  import scriptcache
+  return os.path.join(scriptcache.cache_dir(), 'bugger.sock')
+
+
+##############################
+# Messages
+##############################
+
+# Requests are marshalled dicts, and replies are ints (the child's pid, then
+# its exit status), each preceded by its length.
+def send(sock, data):
+  sock.sendall(struct.pack('!I', len(data)) + data)
+
+def receive(sock):
+  header = receive_exactly(sock, 4)
+  return receive_exactly(sock, struct.unpack('!I', header)[0])
+
+def receive_exactly(sock, size):
+  data = ''
+  while len(data) < size:
+    try:
+      chunk = sock.recv(size - len(data))
+    except socket.error, e:
+      if e.errno == errno.EINTR:
+        continue
+      raise
+    if not chunk:
+      raise EOFError()
+    data += chunk
+  return data
+
+def send_int(sock, value):
+  send(sock, struct.pack('!i', value))
+
+def receive_int(sock):
+  return struct.unpack('!i', receive(sock))[0]
+
+
+STDIO = [0, 1, 2]
+
+
+##############################
+# The client
+##############################
+
+def client(path, argv, script):
+  """Run the command line ARGV, whose script is SCRIPT (an absolute path, or
+  None), on the server at PATH, and return its exit status. Returns None if
+  there's no server there."""
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(path)
+  except socket.error:
+    sock.close()
+    return None
+
+  for fd in STDIO:
+    _multiprocessing.sendfd(sock.fileno(), fd)
+  send(sock, marshal.dumps({
+    'argv': argv,
+    'cwd': os.getcwd(),
+    'env': dict(os.environ),
+    'script': script,
+  }))
+
+  try:
+    pid = receive_int(sock)
+    def forward(signum, frame):
+      try:
+        os.killpg(pid, signum)
+      except OSError:
+        pass
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+      signal.signal(signum, forward)
+    return receive_int(sock)
+  except EOFError:
+    print >>sys.stderr, "bugger: the server went away"
+    return 1
+  finally:
+    sock.close()
+
+
+##############################
+# The server
+##############################
+
+class Scripts(object):
+  """The scripts the server has loaded, with the modification time and size
+  of their files (and their sidecar modules) when they were loaded."""
+
+  def __init__(self):
+    self.scripts = {}
+
+  def load(self, filename, use_cache=True):
+    """Load FILENAME, as scriptcache.load does, unless it's already loaded."""
+    import scriptcache
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size, scriptcache.sidecar_stamp(path))
+    if use_cache and path in self.scripts and self.scripts[path][0] == stamp:
+      return self.scripts[path][1]
+
+    bugger = scriptcache.load(path, use_cache)
+    self.scripts[path] = (stamp, bugger)
+    return bugger
+
+
+def serve(path, handle):
+  """Listen on PATH for requests, and run each by calling HANDLE(argv,
+  scripts) in a child process, where SCRIPTS is the server's Scripts."""
+  if os.path.exists(path):
+    os.remove(path)
+  dir = os.path.dirname(path)
+  if dir and not os.path.isdir(dir):
+    os.makedirs(dir)
+
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  old_umask = os.umask(0077)
+  try:
+    listener.bind(path)
+  finally:
+    os.umask(old_umask)
+  listener.listen(16)
+  print >>sys.stderr, "bugger: listening on %s" % path
+
+  # Let the socket be cleaned up when we're killed
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+  scripts = Scripts()
+  try:
+    while True:
+      accept(listener, handle, scripts)
+  finally:
+    listener.close()
+    os.remove(path)
+
+
+def accept(listener, handle, scripts):
+  """Take the next request, and fork a child to run it."""
+  try:
+    (conn, address) = listener.accept()
+  except socket.error, e:
+    if e.errno == errno.EINTR:
+      return
+    raise
+
+  fds = []
+  try:
+    for fd in STDIO:
+      fds.append(_multiprocessing.recvfd(conn.fileno()))
+    request = marshal.loads(receive(conn))
+  except (OSError, EOFError, ValueError, socket.error):
+    for fd in fds:
+      os.close(fd)
+    conn.close()
+    return
+
+  # Load the script here, so that it's ready for the next request too. Any
+  # errors are left for the child to report.
+  if request['script'] and os.path.isfile(request['script']):
+    try:
+      scripts.load(request['script'])
+    except Exception:
+      pass
+
+  sys.stdout.flush()
+  sys.stderr.flush()
+  pid = os.fork()
+  if pid == 0:
+    listener.close()
+    status = 1
+    try:
+      status = run_request(conn, fds, request, handle, scripts)
+    finally:
+      os._exit(status)
+
+  conn.close()
+  for fd in fds:
+    os.close(fd)
+  reap()
+
+
+def reap():
+  """Collect the children which have finished."""
+  try:
+    while os.waitpid(-1, os.WNOHANG)[0]:
+      pass
+  except OSError:
+    pass
+
+
+def run_request(conn, fds, request, handle, scripts):
+  """In the child, take on the client's stdio, directory and environment, and
+  run the request. Returns the exit status, which the client is sent too."""
+  os.setpgrp()
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+  os.chdir(request['cwd'])
+  os.environ.clear()
+  os.environ.update(request['env'])
+  for (target, fd) in zip(STDIO, fds):
+    os.dup2(fd, target)
+    os.close(fd)
+  sys.argv = request['argv']
+  send_int(conn, os.getpid())
+
+  try:
+    handle(request['argv'], scripts)
+    status = 0
+  except SystemExit, e:
+    if e.code is None or isinstance(e.code, int):
+      status = e.code or 0
+    else:
+      print >>sys.stderr, e.code
+      status = 1
+  except BaseException:
+    traceback.print_exc()
+    status = 1
+
+  sys.stdout.flush()
+  sys.stderr.flush()
+  send_int(conn, status)
+  return status
@@ -0,0 +1,230 @@
+"""Skipping tasks which are already up to date, like make.
+
+A task can declare the files it reads and writes:
+
+  @inputs("src/*.c", "Makefile")
+  @outputs("build/app")
+  build(DIR="build"):
+    $ make -C @DIR
+
+After a successful run, we record the content hashes of its inputs and
+outputs, hashes of its parameters and of the globals it (or any task it calls)
+reads, and a fingerprint of its definition (including every task it calls) in
+a stamp database. The next time the task is called, it is skipped if none of
+those have changed.
+"""
+
+import os
+import glob
+import json
+import base64
+import hashlib
+import tempfile
+import threading
+
+from buggery import StringData, BStr, BuggeryTask, describe
+
+DEFAULT_FILENAME = '.bugger-stamps'
+
+# Bump this if the layout of a stamp changes, so old stamps are ignored.
+FORMAT = 2
+
+
+def hash_file(filename):
+  sha1 = hashlib.sha1()
+  f = file(filename, 'rb')
+  try:
+    while True:
+      data = f.read(64 * 1024)
+      if not data:
+        break
+      sha1.update(data)
+  finally:
+    f.close()
+  return sha1.hexdigest()
+
+
+def hash_value(value):
+  """Hash a variable's value, which may not be text, so that it fits in JSON.
+  None is for variables which aren't set."""
+  if value is None:
+    return None
+  return hashlib.sha1(value.as_bytes()).hexdigest()
+
+
+def expand(patterns):
+  files = set()
+  for pattern in patterns:
+    files.update([f for f in glob.glob(os.path.expanduser(pattern)) if os.path.isfile(f)])
+  return sorted(files)
+
+
+class StampDB(object):
+  """The stamps of the last successful run of each incremental task, kept in a
+  JSON file (by default .bugger-stamps in the current directory)."""
+
+  def __init__(self, filename=DEFAULT_FILENAME):
+    self.filename = filename
+    self.lock = threading.RLock()
+    self.fingerprints = {}
+    self.global_uses = {}
+    self._stamps = None
+
+  def stamps(self):
+    if self._stamps is None:
+      try:
+        self._stamps = json.load(file(self.filename))
+      except (IOError, ValueError):
+        self._stamps = {}
+    return self._stamps
+
+  def save(self):
+    dir = os.path.dirname(os.path.abspath(self.filename))
+    (fd, tmpname) = tempfile.mkstemp(dir=dir, prefix='.bugger-stamps')
+    try:
+      f = os.fdopen(fd, 'w')
+      json.dump(self.stamps(), f, indent=1, sort_keys=True)
+      f.close()
+      os.rename(tmpname, self.filename)
+    except:
+      os.remove(tmpname)
+      raise
+
+
+  def fingerprint(self, buggery, task):
+    """Hash the definition of TASK and of everything it calls."""
+    with self.lock:
+      if task.name not in self.fingerprints:
+        seen = set()
+        todo = [task]
+        sha1 = hashlib.sha1()
+        while todo:
+          t = todo.pop()
+          if t.key in seen:
+            continue
+          seen.add(t.key)
+          sha1.update(repr(describe(t)))
+          todo.extend([buggery.get_task(name) for name in t.callees()])
+        self.fingerprints[task.name] = sha1.hexdigest()
+
+      return self.fingerprints[task.name]
+
+
+  def globals_read(self, buggery, task):
+    """The names of the globals read by TASK and everything it calls. Their
+    values go into the stamp, as they go into the commands which are run."""
+    with self.lock:
+      if task.name not in self.global_uses:
+        seen = set()
+        todo = [task]
+        names = set()
+        while todo:
+          t = todo.pop()
+          if t.key in seen or not isinstance(t, BuggeryTask):
+            continue
+          seen.add(t.key)
+          names.update([name for name in t.uses() if name in buggery.global_layout])
+          todo.extend([buggery.get_task(name) for name in t.callees()])
+        self.global_uses[task.name] = sorted(names)
+
+      return self.global_uses[task.name]
+
+
+  def file_hashes(self, filenames, previous):
+    """Hash each of FILENAMES, reusing the hashes in PREVIOUS for files whose
+    mtime and size haven't changed."""
+    result = {}
+    for filename in filenames:
+      st = os.stat(filename)
+      old = previous.get(filename)
+      if old and old[0] == st.st_mtime and old[1] == st.st_size:
+        result[filename] = old
+      else:
+        result[filename] = [st.st_mtime, st.st_size, hash_file(filename)]
+    return result
+
+
+  def reason_to_run(self, old, new):
+    """Explain why the stamp NEW differs from OLD, or return None if it doesn't."""
+    if old is None:
+      return "it has not been run before"
+
+    if old.get('format') != FORMAT:
+      return "its stamp is from an older version of bugger"
+
+    if old['fingerprint'] != new['fingerprint']:
+      return "its definition has changed"
+
+    for (name, value) in new['params']:
+      if [name, value] not in old['params']:
+        return "parameter %s has changed" % name
+
+    for (name, value) in new['globals']:
+      if [name, value] not in old['globals']:
+        return "global %s has changed" % name
+
+    for kind in ['inputs', 'outputs']:
+      (old_files, new_files) = (old[kind], new[kind])
+      for filename in sorted(new_files):
+        if new_files[filename][2] is None:
+          return "%s %s does not exist" % (kind[:-1], filename)
+        if filename not in old_files:
+          return "%s %s is new" % (kind[:-1], filename)
+        if new_files[filename][2] != old_files[filename][2]:
+          return "%s %s has changed" % (kind[:-1], filename)
+
+      for filename in sorted(old_files):
+        if filename not in new_files:
+          return "%s %s is missing" % (kind[:-1], filename)
+
+    return None
+
+
+  def run(self, buggery, task, run_subtasks):
+    """Call RUN_SUBTASKS() to run TASK, unless it is up to date."""
+    key = task.key
+    old = self.stamps().get(key)
+
+    new = {
+      'format': FORMAT,
+      'fingerprint': self.fingerprint(buggery, task),
+      'params': [[p.name, hash_value(buggery.get_var(p.name))] for p in task.params],
+      'globals': [[name, hash_value(buggery.peek((True, buggery.global_layout[name])))]
+                  for name in self.globals_read(buggery, task)],
+      'input_patterns': task.annotation_values(buggery, 'inputs'),
+      'output_patterns': task.annotation_values(buggery, 'outputs'),
+    }
+
+    new['inputs'] = self.file_hashes(expand(new['input_patterns']), old and old['inputs'] or {})
+    new['outputs'] = self.file_hashes(expand(new['output_patterns']), old and old['outputs'] or {})
+    # An output pattern which matches nothing means the output was never made
+    for pattern in new['output_patterns']:
+      if not expand([pattern]):
+        new['outputs'][pattern] = [None, None, None]
+
+    reason = self.reason_to_run(old, new)
+    if buggery.options.force:
+      reason = "--force was given"
+
+    if reason is None:
+      if buggery.options.verbose or buggery.options.explain:
+        print "Skipping %s: it is up to date" % task.name
+      if old.get('retval') is not None:
+        return StringData(BStr.literal(base64.b64decode(old['retval'])))
+      return None
+
+    if buggery.options.explain:
+      print "Running %s: %s" % (task.name, reason)
+
+    result = run_subtasks()
+
+    # Inputs may have been regenerated, and outputs are new
+    new['inputs'] = self.file_hashes(expand(new['input_patterns']), new['inputs'])
+    new['outputs'] = self.file_hashes(expand(new['output_patterns']), {})
+    new['retval'] = base64.b64encode(result.as_string()) if result is not None else None
+
+    with self.lock:
+      self.stamps()[key] = new
+      self.save()
+
+    return result
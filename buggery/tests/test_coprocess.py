@@ -0,0 +1,33 @@
+from buggery import procio
+from buggery.coprocess import Coprocess
+
+
+def run(shell, command):
+  stdout, stderr = procio.Capture(), procio.Capture()
+  exit_code = shell.run(command, stdout, stderr)
+  return (exit_code, stdout.getvalue(), stderr.getvalue())
+
+
+def test_coprocess_runs_commands():
+  shell = Coprocess()
+  try:
+    assert run(shell, "echo out; echo err >&2; exit 3") == (3, 'out\n', 'err\n')
+    # State doesn't leak from one command to the next
+    assert run(shell, "cd /; FOO=1; export BAR=2")[0] == 0
+    assert run(shell, "echo \"[$FOO][$BAR]\"; cat") == (0, '[][]\n', '')
+    assert run(shell, "printf '%s' \"it's\"") == (0, "it's", '')
+    pid = shell.pid
+    assert run(shell, "true")[0] == 0
+    assert shell.pid == pid
+  finally:
+    shell.close()
+
+
+def test_coprocess_restarts_after_the_shell_dies():
+  shell = Coprocess()
+  try:
+    run(shell, "true")
+    assert run(shell, "kill -9 $$")[0] != 0
+    assert run(shell, "echo again") == (0, 'again\n', '')
+  finally:
+    shell.close()
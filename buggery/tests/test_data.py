@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+
+from buggery import Parser
+from buggery.buggery import RespondFalse
+
+
+class SmallCaptures(RespondFalse):
+  capture_limit = 4
+
+
+SCRIPT = """
+test:
+  X = $ printf ' \\000bin\\n\\n'
+  save ("@DIR/saved", X)
+  append ("@DIR/saved", X)
+  $(X) cat > @DIR/piped
+  $(X) cat |> cat > @DIR/pipeline
+  RETVAL = "@X"
+"""
+
+def run(options):
+  """Run the script, and return the text of X and what was written from it."""
+  dir = tempfile.mkdtemp()
+  try:
+    bugger = Parser().parse(SCRIPT.replace('@DIR', dir))
+    bugger.options = options
+    result = bugger.run('test', [])
+    written = [file(os.path.join(dir, name), 'rb').read() for name in ['saved', 'piped', 'pipeline']]
+    return (result.as_string(), written)
+  finally:
+    shutil.rmtree(dir)
+
+
+def test_output_is_used_exactly():
+  for options in [RespondFalse(), SmallCaptures()]:
+    (text, written) = run(options)
+    assert text == '\x00bin'
+    assert written == [' \x00bin\n\n' * 2, ' \x00bin\n\n', ' \x00bin\n\n']
@@ -0,0 +1,55 @@
+import time
+
+from buggery import Parser
+from buggery.buggery import RespondFalse
+
+
+class Jobs(RespondFalse):
+  jobs = 4
+
+
+SCRIPT = """
+@dataflow
+test:
+  A = $ sleep 0.3; echo a
+  B = $ sleep 0.3; echo b
+  C = $ sleep 0.3; echo @A
+  A2 = $ echo @B
+  @barrier $ sleep 0.3
+  B = $ echo @C
+  RETVAL = $ echo @A@B@C@A2
+"""
+
+def test_dependencies():
+  task = Parser().parse(SCRIPT).tasks['test']
+  assert task.dependencies() == [
+    [],           # A
+    [],           # B
+    [0],          # C reads A
+    [1],          # A2 reads B
+    [0, 1, 2, 3], # the barrier waits for everything before it
+    [1, 2, 3, 4], # B is written again (WAW), after A2 read it (WAR)
+    [0, 1, 2, 3, 4, 5], # RETVAL reads everything, and comes after the barrier
+  ]
+
+
+def test_independent_subtasks_run_at_once():
+  bugger = Parser().parse(SCRIPT)
+  bugger.options = Jobs()
+  start = time.time()
+  assert bugger.run('test', []).as_string() == 'aaab'
+  # A and B at once, then C, then the barrier
+  assert time.time() - start < 1.1
+
+
+def test_stdin_is_a_dependency():
+  bugger = Parser().parse("""
+@dataflow
+test:
+  X = $ sleep 0.3; echo data
+  $(X) cat
+  RETVAL = $(X) cat |> cat
+""")
+  assert bugger.tasks['test'].dependencies() == [[], [0], [0]]
+  bugger.options = Jobs()
+  assert bugger.run('test', []).as_string() == 'data'
@@ -0,0 +1,36 @@
+from buggery.index import Index
+
+
+SCRIPT = """startup:
+  ROOT = "/tmp"
+
+# Builds things
+@pure
+build(NAME):
+  RETVAL = "@ROOT/@NAME"
+
+test:
+  X=build("a")
+  print (X)
+
+unrelated:
+  this isn't even valid
+"""
+
+
+def test_scan():
+  index = Index(SCRIPT)
+  assert [e.name for e in index.order] == ['startup', 'build', 'test', 'unrelated']
+  build = index.entries['build']
+  assert SCRIPT[build.start:build.end].startswith('@pure\nbuild(NAME):')
+  assert build.lineno == 5
+  assert 'build(NAME)' in index.help_string()
+
+
+def test_only_reachable_tasks_are_parsed():
+  bugger = Index(SCRIPT).load(['startup', 'test', 'shutdown'])
+  assert bugger.has_task('test')
+  assert bugger.has_task('build')
+  assert not bugger.has_task('unrelated')
+  assert bugger.tasks['build'].lineno == 6
+  assert bugger.tasks['build'].is_pure()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+
+from buggery import Parser
+from buggery.buggery import RespondFalse
+from buggery.exceptions import CommandError, TaskFailed
+
+
+class KeepGoing(RespondFalse):
+  keep_going = True
+  jobs = 2
+
+
+SCRIPT = """
+test:
+  fails, works("1")
+  { fails, works("2") }
+  works("3")
+  $ false
+  works("never")
+
+fails:
+  $ exit 3
+
+works(N):
+  save ("@DIR/@N", "")
+"""
+
+def run(options):
+  """Run the test task, and return the Buggery object, the error it raised,
+  and the names of the `works` calls which ran."""
+  dir = tempfile.mkdtemp()
+  try:
+    bugger = Parser().parse('startup:\n  DIR = "%s"\n' % dir + SCRIPT)
+    bugger.options = options
+    bugger.run('startup', [])
+    error = None
+    try:
+      bugger.run('test', [])
+    except (CommandError, TaskFailed), error:
+      pass
+    return (bugger, error, sorted(os.listdir(dir)))
+  finally:
+    shutil.rmtree(dir)
+
+
+def test_first_failure_stops_everything():
+  (bugger, error, ran) = run(RespondFalse())
+  assert isinstance(error, CommandError)
+  assert ran == []
+  assert bugger.failures == []
+
+
+def test_keep_going_runs_independent_calls():
+  (bugger, error, ran) = run(KeepGoing())
+  assert isinstance(error, TaskFailed) and error.name == 'test'
+  assert ran == ['1', '2', '3']
+  assert [(task.name, subtask.lineno, proc.exit_code) for (task, subtask, proc) in bugger.failures] == \
+      [('fails', 12, 3), ('fails', 12, 3)]
+
+
+def test_keep_going_skips_calls_reading_unassigned_variables():
+  dir = tempfile.mkdtemp()
+  try:
+    bugger = Parser().parse("""
+test:
+  X = compute
+  use (X)
+  works ("after")
+
+compute:
+  RETVAL = $ false
+
+use(V):
+  works ("used")
+
+works(N):
+  save ("%s/@N", "")
+""" % dir)
+    bugger.options = KeepGoing()
+    try:
+      bugger.run('test', [])
+      assert False, "expected TaskFailed"
+    except TaskFailed, error:
+      assert error.name == 'test'
+    assert os.listdir(dir) == ['after']
+    assert [(task.name, proc.exit_code) for (task, subtask, proc) in bugger.failures] == [('compute', 1)]
+  finally:
+    shutil.rmtree(dir)
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from buggery import Parser
+from buggery.buggery import RespondFalse
+
+
+class LazyStartup(RespondFalse):
+  lazy_startup = True
+  jobs = 4
+
+
+SCRIPT = """
+startup:
+  A = $ echo a >> @LOG; echo A
+  B = $ echo b >> @LOG; echo @A+B
+  C = "c1"
+  D = $ echo d >> @LOG; echo @C
+  C = "c2"
+  E = $ echo e >> @LOG; echo E
+
+uses_b:
+  RETVAL = $ echo @B
+
+uses_e:
+  { uses_e_once, uses_e_once, uses_e_once }
+
+uses_e_once:
+  $ echo @E
+
+nothing:
+  pass
+"""
+
+def run(task, options):
+  """Run startup and TASK, and return the task's result and which startup
+  commands ran, in order."""
+  dir = tempfile.mkdtemp()
+  try:
+    log = os.path.join(dir, 'log')
+    bugger = Parser().parse(SCRIPT.replace('startup:\n', 'startup:\n  LOG = "%s"\n' % log))
+    bugger.options = options
+    bugger.run('startup', [])
+    result = bugger.run(task, [])
+    ran = file(log).read().split() if os.path.exists(log) else []
+    return (result, ran)
+  finally:
+    shutil.rmtree(dir)
+
+
+def test_eager_startup():
+  (result, ran) = run('nothing', RespondFalse())
+  assert ran == ['a', 'b', 'd', 'e']
+
+
+def test_lazy_startup_runs_only_what_is_read():
+  # D reads C, which is assigned twice, so D runs in order
+  assert run('nothing', LazyStartup()) == (None, ['d'])
+  (result, ran) = run('uses_b', LazyStartup())
+  assert result.as_string() == 'A+B'
+  assert ran == ['d', 'a', 'b']
+
+
+def test_lazy_startup_runs_once_across_threads():
+  (result, ran) = run('uses_e', LazyStartup())
+  assert ran == ['d', 'e']
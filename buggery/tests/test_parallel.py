@@ -0,0 +1,91 @@
+import sys
+import time
+import StringIO
+
+from buggery import Parser
+from buggery.buggery import RespondFalse
+from buggery.exceptions import CommandError
+
+
+class Jobs(RespondFalse):
+  def __init__(self, jobs):
+    self.jobs = jobs
+
+
+SCRIPT = """
+ordered:
+  { slow_print, fast_print, fast_print }
+
+slow_print:
+  $ sleep 0.3
+  print ("slow")
+
+fast_print:
+  print ("fast")
+
+wide:
+  { sleep, sleep, sleep, sleep }
+
+nested:
+  { outer, outer }
+
+outer:
+  { sleep, sleep }
+
+sleep:
+  $ sleep 0.3
+
+fail_fast:
+  { slow_fail, fail, sleep_long }
+
+slow_fail:
+  $ sleep 0.2; exit 4
+
+fail:
+  $ sleep 0.1; exit 3
+
+sleep_long:
+  $ sleep 5; true
+"""
+
+def run(task, jobs):
+  """Run TASK with -j JOBS, and return how long it took and what it printed."""
+  bugger = Parser().parse(SCRIPT)
+  bugger.options = Jobs(jobs)
+  old_stdout = sys.stdout
+  sys.stdout = StringIO.StringIO()
+  try:
+    start = time.time()
+    bugger.run(task, [])
+    return (time.time() - start, sys.stdout.getvalue())
+  finally:
+    sys.stdout = old_stdout
+
+
+def test_output_is_in_order():
+  (elapsed, output) = run('ordered', 3)
+  assert output == "slow\nfast\nfast\n"
+
+
+def test_jobs_limit():
+  (elapsed, output) = run('wide', 4)
+  assert elapsed < 0.55
+  (elapsed, output) = run('wide', 2)
+  assert 0.6 <= elapsed < 1.2
+
+
+def test_jobs_limit_covers_nested_groups():
+  # Four sleeps, two at a time, however they're grouped
+  (elapsed, output) = run('nested', 2)
+  assert 0.6 <= elapsed < 1.2
+
+
+def test_fail_fast():
+  start = time.time()
+  try:
+    run('fail_fast', 3)
+    assert False, "expected a CommandError"
+  except CommandError, e:
+    # The first failure is reported, and the long sleep is killed
+    assert e.proc.exit_code == 3
+  assert time.time() - start < 2
@@ -0,0 +1,40 @@
+from buggery import Parser
+from buggery.exceptions import CommandError
+
+
+SCRIPT = """
+count:
+  RETVAL=$ printf 'a\\nb\\nc\\n' |> grep -v b |> wc -l
+
+head:
+  RETVAL=$ yes |> head -n 1
+
+middle_fails:
+  $ echo a |> sh -c 'cat; exit 5' |> cat
+"""
+
+def run(task):
+  return Parser().parse(SCRIPT).run(task, [])
+
+
+def test_result_is_the_last_stage():
+  result = run('count')
+  assert result.as_string() == '2'
+  assert result.exit_codes == [0, 0, 0]
+
+
+def test_sigpipe_in_earlier_stages_is_success():
+  # yes is killed by SIGPIPE once head has stopped reading
+  result = run('head')
+  assert result.as_string() == 'y'
+  assert result.exit_code == 0
+  assert result.exit_codes == [0, 0]
+
+
+def test_failing_middle_stage():
+  try:
+    run('middle_fails')
+    assert False, "expected a CommandError"
+  except CommandError, e:
+    assert e.proc.exit_code == 5
+    assert e.proc.exit_codes == [0, 5, 0]
@@ -0,0 +1,92 @@
+import subprocess
+
+from buggery import procio
+
+
+def test_capture_in_memory():
+  capture = procio.Capture()
+  for i in range(1000):
+    capture.write('x')
+  assert capture.spill is None
+  assert capture.getvalue() == 'x' * 1000
+
+
+def test_capture_spills_past_limit():
+  capture = procio.Capture(limit=10)
+  capture.write('a' * 8)
+  assert capture.spill is None
+  capture.write('b' * 8)
+  capture.write('c')
+  assert capture.spill is not None
+  assert capture.chunks == []
+  assert capture.getvalue() == 'a' * 8 + 'b' * 8 + 'c'
+
+
+def test_communicate_large_stdin():
+  # More than a pipe buffer in both directions, which deadlocks if stdin
+  # isn't written and stdout read at the same time.
+  input = 'line\n' * 100000
+  stdout, stderr = procio.Capture(), procio.Capture()
+  proc = subprocess.Popen('cat; echo done >&2', shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  assert procio.communicate(proc, input, stdout, stderr) == 0
+  assert stdout.getvalue() == input
+  assert stderr.getvalue() == 'done\n'
+
+
+def test_direct_argv():
+  assert procio.direct_argv("make -C 'build dir' all") == ['make', '-C', 'build dir', 'all']
+  for command in ["ls | wc", "cat < x", "ls *.c", "echo $HOME", "cd /tmp", "FOO=1 make", "a && b", "echo hi"]:
+    assert procio.direct_argv(command) is None, command
+
+
+def test_popen_falls_back_to_the_shell():
+  proc = procio.popen("no-such-program-anywhere", True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  (stdout, stderr) = proc.communicate()
+  assert proc.returncode == 127
+
+
+def test_spilled_capture_opens_from_the_start():
+  capture = procio.Capture(limit=4)
+  capture.write('\x00abc\n')
+  capture.write('def\n')
+  first, second = capture.open(), capture.open()
+  assert first.read(2) == '\x00a'
+  assert second.read() == '\x00abc\ndef\n'
+  first.close()
+  second.close()
+  assert procio.Capture().open() is None
+
+
+def test_capture_write_to():
+  import StringIO
+  for limit in [None, 4]:
+    capture = procio.Capture(limit)
+    capture.write(' x \n')
+    capture.write('y\n')
+    f = StringIO.StringIO()
+    capture.write_to(f)
+    assert f.getvalue() == ' x \ny\n'
+
+
+def test_pwd_is_the_shells():
+  # In a symlinked directory, the shell's pwd prints the link, from $PWD, and
+  # /bin/pwd prints the real directory
+  import os, shutil, tempfile
+  dir = tempfile.mkdtemp()
+  old_cwd, old_pwd = os.getcwd(), os.environ.get('PWD')
+  try:
+    os.mkdir(os.path.join(dir, 'real'))
+    link = os.path.join(dir, 'link')
+    os.symlink(os.path.join(dir, 'real'), link)
+    os.chdir(link)
+    os.environ['PWD'] = link
+    assert procio.direct_argv("pwd") is None
+    proc = procio.popen("pwd", True, stdout=subprocess.PIPE)
+    assert proc.communicate()[0] == link + '\n'
+  finally:
+    os.chdir(old_cwd)
+    if old_pwd is None:
+      del os.environ['PWD']
+    else:
+      os.environ['PWD'] = old_pwd
+    shutil.rmtree(dir)
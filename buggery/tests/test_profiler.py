@@ -0,0 +1,72 @@
+import os
+import json
+import shutil
+import tempfile
+
+from buggery import Parser, profiler
+
+
+SCRIPT = """
+test:
+  child
+  child
+  $ sleep 0.2
+
+child:
+  $ sleep 0.1
+"""
+
+def profile(trace=False):
+  bugger = Parser().parse(SCRIPT)
+  bugger.profiler = profiler.Profiler(trace)
+  bugger.run('test', [])
+  return bugger.profiler
+
+
+def test_call_tree():
+  p = profile()
+  [test] = p.root.order
+  assert (test.kind, test.name, test.calls) == ('task', 'test', 1)
+
+  [child, command] = test.order
+  assert (child.name, child.calls) == ('child', 2)
+  assert (command.kind, command.name, command.site) == ('command', 'sleep 0.2', (5, 3))
+  assert command.label() == "$ sleep 0.2 (5:3)"
+  [child_command] = child.order
+  assert (child_command.site, child_command.calls) == ((8, 3), 2)
+
+
+def test_inclusive_and_exclusive_time():
+  p = profile()
+  [test] = p.root.order
+  [child, command] = test.order
+  assert test.wall >= 0.4
+  assert child.wall >= 0.2 and command.wall >= 0.2
+  # Nearly all of test's time is in its children
+  assert test.exclusive() < 0.1
+  assert abs(test.exclusive() - (test.wall - child.wall - command.wall)) < 1e-9
+
+  totals = dict([(t[0], t[1:]) for t in p.totals()])
+  assert totals['child'][0] == 2
+  assert totals['$ sleep 0.1 (8:3)'][0] == 2
+
+
+def test_trace():
+  p = profile(trace=True)
+  dir = tempfile.mkdtemp()
+  try:
+    filename = os.path.join(dir, 'trace.json')
+    p.write_trace(filename)
+    trace = json.load(file(filename))
+  finally:
+    shutil.rmtree(dir)
+
+  events = trace['traceEvents']
+  assert sorted([e['name'] for e in events]) == sorted(
+    ['test', 'child', 'child', '$ sleep 0.1 (8:3)', '$ sleep 0.1 (8:3)', '$ sleep 0.2 (5:3)'])
+  for e in events:
+    assert e['ph'] == 'X' and e['dur'] >= 0 and e['pid'] == os.getpid()
+  [command] = [e for e in events if e['name'].startswith('$ sleep 0.2')]
+  assert (command['cat'], command['args']) == ('command', {'site': '5:3'})
+  [test] = [e for e in events if e['name'] == 'test']
+  assert test['dur'] >= command['dur'] and test['ts'] <= command['ts']
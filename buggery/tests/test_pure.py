@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+
+from buggery import Parser
+
+
+SCRIPT = """
+@pure
+path(DIR):
+  $ echo @DIR >> @LOG
+  RETVAL=$ echo /tmp/@DIR
+
+test:
+  A=path("a")
+  B=path("a")
+  C=path("b")
+  D=path("a")
+  RETVAL="@A @B @C @D"
+"""
+
+def test_pure_task_runs_once_per_argument():
+  dir = tempfile.mkdtemp()
+  try:
+    log = os.path.join(dir, 'log')
+    bugger = Parser().parse(SCRIPT.replace('@LOG', log))
+    assert bugger.run('test', []).as_string() == '/tmp/a /tmp/a /tmp/b /tmp/a'
+    assert file(log).read().split() == ['a', 'b']
+    assert (bugger.memo_hits, bugger.memo_misses) == (2, 2)
+  finally:
+    shutil.rmtree(dir)
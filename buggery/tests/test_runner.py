@@ -0,0 +1,51 @@
+import select
+import time
+
+from buggery import Parser
+from buggery.exceptions import CommandError
+
+
+SCRIPT = """
+startup:
+  GREETING = "hello"
+
+greet(NAME):
+  print ("@GREETING @NAME")
+  RETVAL = $ echo @NAME
+
+slow:
+  $ sleep 10; true
+"""
+
+def test_runs_are_independent():
+  bugger = Parser().parse(SCRIPT)
+  runs = [bugger.run_async('greet', [name]) for name in ['a', 'b', 'c']]
+  assert [run.result().as_string() for run in runs] == ['a', 'b', 'c']
+  assert [run.output() for run in runs] == ['hello a\n', 'hello b\n', 'hello c\n']
+  # The original's globals weren't touched
+  assert bugger.globals == [None]
+  for run in runs:
+    run.close()
+
+
+def test_fileno_becomes_readable():
+  bugger = Parser().parse(SCRIPT)
+  run = bugger.run_async('greet', ['x'])
+  (readable, _, _) = select.select([run], [], [], 10)
+  assert readable == [run] and run.done()
+  run.close()
+
+
+def test_cancel():
+  bugger = Parser().parse(SCRIPT)
+  run = bugger.run_async('slow')
+  start = time.time()
+  time.sleep(0.2)
+  run.cancel()
+  try:
+    run.result()
+    assert False, "the run wasn't cancelled"
+  except CommandError:
+    pass
+  assert time.time() - start < 2
+  run.close()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+
+from buggery import scriptcache
+
+
+def with_cache_dir(func):
+  def wrapper():
+    dir = tempfile.mkdtemp()
+    old = os.environ.get('BUGGERY_CACHE_DIR')
+    os.environ['BUGGERY_CACHE_DIR'] = dir
+    try:
+      func(dir)
+    finally:
+      if old is None:
+        del os.environ['BUGGERY_CACHE_DIR']
+      else:
+        os.environ['BUGGERY_CACHE_DIR'] = old
+      shutil.rmtree(dir)
+
+  wrapper.__name__ = func.__name__
+  return wrapper
+
+
+def write(dir, contents):
+  filename = os.path.join(dir, 'script.bgr')
+  file(filename, 'w').write(contents)
+  return filename
+
+
+@with_cache_dir
+def test_cache_roundtrip(dir):
+  filename = write(dir, 'test:\n  X = "a"\n  print (X)\n')
+  first = scriptcache.load(filename)
+  assert os.path.exists(scriptcache.entry_filename(os.path.abspath(filename)))
+
+  second = scriptcache.load(filename)
+  assert second is not first
+  assert second.has_task('test')
+  assert second.has_task('print') # builtins are recreated
+
+
+@with_cache_dir
+def test_cache_notices_changes(dir):
+  filename = write(dir, 'test:\n  print ("a")\n')
+  scriptcache.load(filename)
+
+  write(dir, 'other:\n  print ("a")\n')
+  bugger = scriptcache.load(filename)
+  assert bugger.has_task('other')
+  assert not bugger.has_task('test')
+
+
+def checked_tasks(func):
+  """Run FUNC, and return the names of the tasks checked while it ran."""
+  from buggery.buggery import Checker
+  checked = []
+  original = Checker.check_task
+  def check_task(self, task):
+    checked.append(task.name)
+    original(self, task)
+  Checker.check_task = check_task
+  try:
+    func()
+  finally:
+    Checker.check_task = original
+  return sorted(checked)
+
+
+@with_cache_dir
+def test_only_changed_tasks_are_rechecked(dir):
+  filename = write(dir, 'a:\n  b ("x")\n\nb(X):\n  print (X)\n\nc:\n  print ("c")\n')
+  assert checked_tasks(lambda: scriptcache.load(filename)) == ['a', 'b', 'c']
+
+  write(dir, 'a:\n  b ("x")\n\nb(X):\n  print ("@X!")\n\nc:\n  print ("c")\n')
+  assert checked_tasks(lambda: scriptcache.load(filename)) == ['b']
+
+
+@with_cache_dir
+def test_callers_are_rechecked(dir):
+  from buggery.exceptions import UserError
+  filename = write(dir, 'a:\n  b ("x")\n\nb(X):\n  print (X)\n')
+  scriptcache.load(filename)
+
+  # a's text hasn't changed, but it now calls b with too many arguments
+  write(dir, 'a:\n  b ("x")\n\nb:\n  print ("b")\n')
+  try:
+    scriptcache.load(filename)
+  except UserError:
+    pass
+  else:
+    assert False, "expected a UserError"
+
+
+@with_cache_dir
+def test_cached_calls_are_bound(dir):
+  filename = write(dir, 'test:\n  again\n  print ("a")\n\nagain:\n  again\n')
+  scriptcache.load(filename)
+  bugger = scriptcache.load(filename)
+  (again, printer) = bugger.tasks['test'].subtasks
+  assert again.task is bugger.tasks['again']
+  assert printer.task is bugger.tasks['print']
+  assert bugger.tasks['again'].subtasks[0].task is bugger.tasks['again']
@@ -0,0 +1,43 @@
+import os
+import shutil
+import socket
+import tempfile
+
+from buggery import server
+
+
+def test_messages():
+  (a, b) = socket.socketpair()
+  server.send(a, 'x' * 100000)
+  server.send_int(a, -3)
+  assert server.receive(b) == 'x' * 100000
+  assert server.receive_int(b) == -3
+
+
+def test_scripts_are_reloaded_when_they_change():
+  dir = tempfile.mkdtemp()
+  old = os.environ.get('BUGGERY_CACHE_DIR')
+  os.environ['BUGGERY_CACHE_DIR'] = dir
+  try:
+    filename = os.path.join(dir, 'script.bgr')
+    file(filename, 'w').write('test:\n  print ("a")\n')
+    scripts = server.Scripts()
+    first = scripts.load(filename)
+    assert scripts.load(filename) is first
+
+    file(filename, 'w').write('other:\n  print ("a")\n')
+    os.utime(filename, (0, 0))
+    second = scripts.load(filename)
+    assert second is not first and second.has_task('other')
+  finally:
+    if old is None:
+      del os.environ['BUGGERY_CACHE_DIR']
+    else:
+      os.environ['BUGGERY_CACHE_DIR'] = old
+    shutil.rmtree(dir)
+
+
+def test_client_without_a_server():
+  path = os.path.join(tempfile.mkdtemp(), 'none.sock')
+  assert server.client(path, ['bugger'], None) is None
+  os.rmdir(os.path.dirname(path))
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+
+from buggery import Parser, scriptcache
+from buggery.exceptions import UserError
+from test_scriptcache import with_cache_dir
+
+
+SIDECAR = """
+import os
+
+def exists(path):
+  return os.path.exists(path)
+
+def join(*parts):
+  return "/".join(parts)
+
+def _helper():
+  pass
+"""
+
+SCRIPT = """
+test:
+  RETVAL = join ("a", "b", "c")
+
+check:
+  RETVAL = exists ("/")
+"""
+
+def write(dir, script=SCRIPT, sidecar=SIDECAR):
+  filename = os.path.join(dir, 'build.bgr')
+  file(filename, 'w').write(script)
+  file(os.path.join(dir, 'build.py'), 'w').write(sidecar)
+  return filename
+
+
+@with_cache_dir
+def test_sidecar_functions_are_tasks(dir):
+  bugger = Parser().parse(file(write(dir)).read(), filename=os.path.join(dir, 'build.bgr'))
+  assert bugger.run('test', []).as_string() == 'a/b/c'
+  assert bugger.run('check', []).as_string() == 'true'
+  assert not bugger.has_task('_helper')
+  assert not bugger.has_task('os')
+
+
+@with_cache_dir
+def test_sidecar_calls_are_checked(dir):
+  filename = write(dir, 'test:\n  exists ()\n')
+  try:
+    Parser().parse(file(filename).read(), filename=filename)
+    assert False, "expected a UserError"
+  except UserError:
+    pass
+
+
+@with_cache_dir
+def test_sidecar_cache_roundtrip(dir):
+  filename = write(dir)
+  scriptcache.load(filename)
+  bugger = scriptcache.load(filename)
+  assert bugger.run('test', []).as_string() == 'a/b/c'
+
+  # A changed sidecar is checked against again
+  write(dir, sidecar=SIDECAR.replace('def join', 'def joined'))
+  try:
+    scriptcache.load(filename)
+    assert False, "expected a UserError"
+  except UserError:
+    pass
+
+
+def test_register():
+  from buggery.buggery import Buggery
+  bugger = Buggery(Parser().parse_tasks('test:\n  RETVAL = double ("ab")\n', 1))
+  bugger.register('double', lambda s: s * 2)
+  bugger.check()
+  assert bugger.run('test', []).as_string() == 'abab'
+
+
+class Greeter(object):
+  def __init__(self, greeting):
+    self.greeting = greeting
+
+  def greet(self, name, punctuation="!"):
+    return self.greeting + " " + name + punctuation
+
+
+def registered(script, name, function):
+  from buggery.buggery import Buggery
+  bugger = Buggery(Parser().parse_tasks(script, 1))
+  bugger.register(name, function)
+  bugger.check()
+  return bugger
+
+
+def test_register_bound_method():
+  bugger = registered('test:\n  RETVAL = greet ("you")\n', 'greet', Greeter("hello").greet)
+  assert bugger.run('test', []).as_string() == 'hello you!'
+  assert bugger.tasks['greet'].summary().key() == (True, 2, 1)
+
+
+def test_register_builtin_and_partial():
+  import functools
+  bugger = registered('test:\n  RETVAL = plen ("abc")\n', 'plen', len)
+  assert bugger.run('test', []).as_string() == '3'
+
+  bugger = registered('test:\n  RETVAL = j ("y")\n', 'j', functools.partial(os.path.join, '/x'))
+  assert bugger.run('test', []).as_string() == '/x/y'
+
+  punctuate = functools.partial(Greeter("hi").greet, punctuation="?")
+  bugger = registered('test:\n  RETVAL = p ("you")\n', 'p', punctuate)
+  assert bugger.run('test', []).as_string() == 'hi you?'
+  assert bugger.tasks['p'].summary().key() == (True, 1, 1)
+
+
+def test_register_checks_bound_method_arity():
+  try:
+    registered('test:\n  RETVAL = greet ()\n', 'greet', Greeter("hello").greet)
+    assert False, "expected a UserError"
+  except UserError:
+    pass
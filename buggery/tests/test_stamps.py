@@ -0,0 +1,125 @@
+import os
+import sys
+import shutil
+import tempfile
+import StringIO
+
+from buggery import Parser, stamps
+from buggery.buggery import RespondFalse
+
+
+class Force(RespondFalse):
+  force = True
+
+class Explain(RespondFalse):
+  explain = True
+
+
+SCRIPT = """
+startup:
+  DIR = "@ROOT"
+  MODE = "@MODE"
+
+@inputs("@DIR/in.txt")
+@outputs("@DIR/out.txt")
+build:
+  $ echo run >> @DIR/log
+  describe
+  RETVAL = $ printf '\\377'
+
+describe:
+  $ sh -c 'echo @MODE > @DIR/out.txt'
+"""
+
+class Script(object):
+  """A script with an incremental task, run in a temporary directory."""
+
+  def __init__(self):
+    self.dir = tempfile.mkdtemp()
+    self.write('in.txt', 'a')
+    self.db = stamps.StampDB(os.path.join(self.dir, 'stamps'))
+
+  def write(self, name, contents):
+    file(os.path.join(self.dir, name), 'w').write(contents)
+
+  def read(self, name):
+    return file(os.path.join(self.dir, name)).read()
+
+  def runs(self):
+    return self.read('log').count('run')
+
+  def build(self, mode='debug', options=RespondFalse()):
+    """Run build, and return its result and what it printed."""
+    bugger = Parser().parse(SCRIPT.replace('@ROOT', self.dir).replace('@MODE"', mode + '"'))
+    bugger.stamps = self.db
+    bugger.options = options
+    old_stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+      bugger.run('startup', [])
+      result = bugger.run('build', [])
+      return (result, sys.stdout.getvalue())
+    finally:
+      sys.stdout = old_stdout
+
+  def close(self):
+    shutil.rmtree(self.dir)
+
+
+def with_script(func):
+  def wrapper():
+    script = Script()
+    try:
+      func(script)
+    finally:
+      script.close()
+
+  wrapper.__name__ = func.__name__
+  return wrapper
+
+
+@with_script
+def test_up_to_date_task_is_skipped(script):
+  (result, _) = script.build()
+  assert script.runs() == 1
+  (skipped, output) = script.build(options=Explain())
+  assert script.runs() == 1
+  assert output == "Skipping build: it is up to date\n"
+  # Its result is kept, even though it isn't text
+  assert skipped.as_string() == result.as_string() == '\xff'
+  # ... and nothing is left behind by saving the stamps
+  assert sorted(os.listdir(script.dir)) == ['in.txt', 'log', 'out.txt', 'stamps']
+
+
+@with_script
+def test_force(script):
+  script.build()
+  (_, output) = script.build(options=Force())
+  assert script.runs() == 2
+
+
+@with_script
+def test_changed_input(script):
+  script.build()
+  script.write('in.txt', 'b')
+  (_, output) = script.build(options=Explain())
+  assert script.runs() == 2
+  assert output == "Running build: input %s has changed\n" % os.path.join(script.dir, 'in.txt')
+
+
+@with_script
+def test_missing_output(script):
+  script.build()
+  os.remove(os.path.join(script.dir, 'out.txt'))
+  script.build()
+  assert script.runs() == 2
+
+
+@with_script
+def test_changed_global(script):
+  # MODE is only read by a task build calls
+  script.build('debug')
+  (_, output) = script.build('release', options=Explain())
+  assert script.runs() == 2
+  assert output == "Running build: global MODE has changed\n"
+  assert script.read('out.txt') == 'release\n'